@@ -0,0 +1,244 @@
+"""Загрузка картинок и вложений задач: общее для parse_fipi_pages.py и download_assets.py.
+
+Сессия с повторами (make_session) общая и для download_fipi_pages.py.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import threading
+from collections.abc import Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from urllib3.util.retry import Retry
+
+BASE_CONTEXT_URL = "https://ege.fipi.ru/"
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+)
+SKIP_SSL_VERIFY = os.environ.get("FIPI_SKIP_SSL_VERIFY", "0") not in {"0", "", "false", "False"}
+DOWNLOAD_WORKERS = 16
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+RETRIES = 3
+RETRY_BACKOFF = 0.5  # паузы между повторами: 0.5, 1, 2 с (или сколько скажет Retry-After)
+
+
+@dataclass(frozen=True, slots=True)
+class AssetMapping:
+    internal_id: str
+    source_url: str
+    short_name: str
+    saved_path: Path
+    original_name: str
+
+
+def normalize_url(url: str) -> str | None:
+    url = url.strip()
+    if not url or url.startswith("data:"):
+        return None
+    return urljoin(BASE_CONTEXT_URL, url)
+
+
+def replace_sources(html: str, replacements: dict[str, str]) -> str:
+    """Заменяет все исходные пути за один проход по строке.
+
+    Длинные пути в альтернативе идут первыми, чтобы не резать их по общему префиксу.
+    Regex компилируем только когда в HTML реально встречается больше одного пути.
+    """
+    sources = [source for source in replacements if source in html]
+    if not sources:
+        return html
+    if len(sources) == 1:
+        return html.replace(sources[0], replacements[sources[0]])
+    sources.sort(key=len, reverse=True)
+    pattern = re.compile("|".join(re.escape(source) for source in sources))
+    return pattern.sub(lambda m: replacements[m.group(0)], html)
+
+
+def make_retry() -> Retry:
+    """Повторяем только временные ошибки (429/5xx, обрывы соединения); 4xx отдаём сразу.
+
+    Единственная политика повторов для всех загрузчиков (страницы, картинки, вложения).
+    После исчерпания попыток возвращается последний ответ, а не исключение, чтобы в логе
+    был виден статус.
+    """
+    return Retry(
+        total=RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def make_session(pool_size: int) -> requests.Session:
+    """Сессия с keep-alive пулом на `pool_size` соединений к одному хосту.
+
+    Все запросы идут на ege.fipi.ru, поэтому TLS-рукопожатие делается один раз на соединение
+    пула, а потоки переиспользуют уже открытые соединения.
+    """
+    session = requests.Session()
+    session.headers.update({"User-Agent": USER_AGENT})
+    session.verify = not SKIP_SSL_VERIFY
+    # Пул соединений под число потоков, иначе urllib3 будет закрывать «лишние» соединения.
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=make_retry()
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if SKIP_SSL_VERIFY:
+        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)  # type: ignore[attr-defined]
+    return session
+
+
+def _download_one(session: requests.Session, entry: AssetMapping, lock: threading.Lock) -> bool:
+    target = entry.saved_path
+    url = normalize_url(entry.source_url)
+    if not url:
+        with lock:
+            print(f"Пропускаю некорректную ссылку: {entry.source_url}")
+        return False
+    part = target.with_name(target.name + ".part")
+    urls_to_try = [url]
+    if "/bank/" in url:
+        urls_to_try.append(url.replace("/bank/", "/"))
+
+    last_status: int | None = None
+    for candidate in urls_to_try:
+        try:
+            # Пишем кусками во временный .part и переносим на место только целиком:
+            # оборванная загрузка не должна выглядеть как уже скачанный файл.
+            with session.get(candidate, timeout=30, stream=True) as resp:
+                last_status = resp.status_code
+                if resp.status_code != 200:
+                    continue
+                with part.open("wb") as f:
+                    for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+        except requests.RequestException as exc:
+            part.unlink(missing_ok=True)
+            with lock:
+                print(f"Ошибка загрузки {candidate}: {exc}")
+            continue
+        os.replace(part, target)
+        with lock:
+            print(f"Сохранено {target} из {candidate} ({target.stat().st_size} байт)")
+        return True
+
+    status_info = f"статус {last_status}" if last_status is not None else "нет ответа"
+    with lock:
+        print(f"Не удалось скачать {url} ({status_info})")
+    return False
+
+
+def link_or_copy(source: Path, target: Path) -> None:
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def list_existing(dirs: Iterable[Path]) -> set[Path]:
+    """Один проход os.scandir по каждому каталогу вместо stat на каждый файл."""
+    existing: set[Path] = set()
+    for directory in dirs:
+        try:
+            with os.scandir(directory) as it:
+                existing.update(directory / item.name for item in it)
+        except FileNotFoundError:
+            continue
+    return existing
+
+
+def _download_group(
+    session: requests.Session,
+    group: list[AssetMapping],
+    existing: set[Path],
+    lock: threading.Lock,
+) -> bool:
+    """Скачивает общий URL группы один раз и раскладывает файл по всем коротким именам.
+
+    Возвращает True, если файл действительно был скачан из сети.
+    """
+    downloaded = False
+    present = next((e.saved_path for e in group if e.saved_path in existing), None)
+    if present is None:
+        if not _download_one(session, group[0], lock):
+            return False
+        present = group[0].saved_path
+        downloaded = True
+    for entry in group:
+        if entry.saved_path != present and entry.saved_path not in existing:
+            link_or_copy(present, entry.saved_path)
+            with lock:
+                print(f"Связано {entry.saved_path} с {present}")
+    return downloaded
+
+
+def download_groups(
+    session: requests.Session,
+    groups: Iterable[list[AssetMapping]],
+    existing: set[Path],
+    *,
+    max_files: int | None,
+    workers: int,
+) -> int:
+    """Качает группы пулом потоков, пока не наберётся `max_files` успешных загрузок.
+
+    В работе не больше загрузок, чем осталось до лимита: неудачная загрузка освобождает
+    место, и на него берётся следующая группа. Возвращает число скачанных файлов.
+    """
+    lock = threading.Lock()
+    queue = iter(groups)
+    downloaded = 0
+    running: set[Future[bool]] = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            free = workers if max_files is None else min(workers, max_files - downloaded)
+            while len(running) < free and (group := next(queue, None)) is not None:
+                running.add(executor.submit(_download_group, session, group, existing, lock))
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            downloaded += sum(future.result() for future in done)
+    if next(queue, None) is not None:
+        print(f"Достигнут лимит {max_files} файлов, останавливаюсь.")
+    return downloaded
+
+
+def download_entries(
+    entries: list[AssetMapping],
+    *,
+    max_files: int | None = None,
+    filter_substr: str | None = None,
+    workers: int = DOWNLOAD_WORKERS,
+) -> int:
+    """Скачивает недостающие файлы из map; возвращает число скачанных из сети."""
+    # Один и тот же URL может встречаться у разных internal_id: качаем его один раз,
+    # а остальные короткие имена делаем жёсткими ссылками на скачанный файл.
+    groups: dict[str, list[AssetMapping]] = {}
+    for entry in entries:
+        if filter_substr and filter_substr not in entry.source_url:
+            continue
+        url_key = normalize_url(entry.source_url) or entry.source_url
+        groups.setdefault(url_key, []).append(entry)
+    existing = list_existing({entry.saved_path.parent for entry in entries})
+    pending = [
+        group for group in groups.values() if not all(e.saved_path in existing for e in group)
+    ]
+    # Каталоги создаём один раз до запуска потоков, а не на каждый файл.
+    for parent in {entry.saved_path.parent for group in pending for entry in group}:
+        parent.mkdir(parents=True, exist_ok=True)
+
+    session = make_session(pool_size=workers)
+    return download_groups(session, pending, existing, max_files=max_files, workers=workers)
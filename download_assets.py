@@ -2,41 +2,32 @@ from __future__ import annotations
 
 import argparse
 import json
-import os
-from collections import Counter
+from collections import defaultdict
 from dataclasses import dataclass
 from pathlib import Path
-from urllib.parse import urljoin, urlsplit
+from urllib.parse import urlsplit
 
-import requests
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-
-BASE_CONTEXT_URL = "https://ege.fipi.ru/"
-USER_AGENT = (
-    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
-    "(KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+from asset_fetch import (
+    DOWNLOAD_WORKERS,
+    AssetMapping,
+    download_entries,
+    replace_sources,
 )
+
 ASSETS_DIR = Path("assets")
 MAP_PATH = Path("map.json")
-SKIP_SSL_VERIFY = os.environ.get("FIPI_SKIP_SSL_VERIFY", "0") not in {"0", "", "false", "False"}
+# json.dumps(..., ensure_ascii=False) собирает новый JSONEncoder на каждый вызов — держим свои.
+JSONL_DECODER = json.JSONDecoder()
+JSONL_ENCODER = json.JSONEncoder(ensure_ascii=False)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class AssetCandidate:
     internal_id: str
     source: str
     kind: str  # "image" | "attachment"
 
 
-@dataclass(frozen=True)
-class AssetMapping:
-    internal_id: str
-    source_url: str
-    short_name: str
-    saved_path: Path
-    original_name: str
-
-
 def read_tasks(tasks_path: Path) -> list[dict]:
     tasks: list[dict] = []
     with tasks_path.open(encoding="utf-8") as f:
@@ -45,20 +36,13 @@ def read_tasks(tasks_path: Path) -> list[dict]:
             if not line:
                 continue
             try:
-                task = json.loads(line)
+                task = JSONL_DECODER.decode(line)
             except json.JSONDecodeError:
                 continue
             tasks.append(task)
     return tasks
 
 
-def normalize_url(url: str) -> str | None:
-    url = url.strip()
-    if not url or url.startswith("data:"):
-        return None
-    return urljoin(BASE_CONTEXT_URL, url)
-
-
 def choose_extension(url: str) -> str:
     parsed = urlsplit(url)
     ext = Path(parsed.path).suffix
@@ -96,32 +80,32 @@ def build_asset_candidates(tasks: list[dict]) -> list[AssetCandidate]:
 def build_asset_mapping(
     candidates: list[AssetCandidate], assets_dir: Path
 ) -> tuple[dict[tuple[str, str], AssetMapping], list[AssetMapping]]:
-    per_internal_total = Counter(item.internal_id for item in candidates)
-    per_internal_index: Counter[str] = Counter()
+    buckets: dict[str, list[AssetCandidate]] = {}
+    for candidate in candidates:
+        buckets.setdefault(candidate.internal_id, []).append(candidate)
+
     mapping_by_key: dict[tuple[str, str], AssetMapping] = {}
     ordered_entries: list[AssetMapping] = []
 
-    for candidate in candidates:
-        per_internal_index[candidate.internal_id] += 1
-        index = per_internal_index[candidate.internal_id]
-        total = per_internal_total[candidate.internal_id]
-
-        ext = choose_extension(candidate.source)
-        suffix = "" if total == 1 else f"_{index}"
-        short_name = f"{candidate.internal_id}{suffix}{ext}"
-        saved_path = assets_dir / short_name
-        original_name = Path(urlsplit(candidate.source).path).name or short_name
-
-        key = (candidate.internal_id, candidate.source)
-        mapping = AssetMapping(
-            internal_id=candidate.internal_id,
-            source_url=candidate.source,
-            short_name=short_name,
-            saved_path=saved_path,
-            original_name=original_name,
-        )
-        mapping_by_key[key] = mapping
-        ordered_entries.append(mapping)
+    for internal_id, bucket in buckets.items():
+        single = len(bucket) == 1
+        for index, candidate in enumerate(bucket, start=1):
+            ext = choose_extension(candidate.source)
+            suffix = "" if single else f"_{index}"
+            short_name = f"{internal_id}{suffix}{ext}"
+            saved_path = assets_dir / short_name
+            original_name = Path(urlsplit(candidate.source).path).name or short_name
+
+            key = (internal_id, candidate.source)
+            mapping = AssetMapping(
+                internal_id=internal_id,
+                source_url=candidate.source,
+                short_name=short_name,
+                saved_path=saved_path,
+                original_name=original_name,
+            )
+            mapping_by_key[key] = mapping
+            ordered_entries.append(mapping)
 
     return mapping_by_key, ordered_entries
 
@@ -142,97 +126,50 @@ def write_map(entries: list[AssetMapping], map_path: Path) -> None:
 def rewrite_tasks(
     tasks: list[dict], mapping_by_key: dict[tuple[str, str], AssetMapping]
 ) -> list[dict]:
-    updated: list[dict] = []
+    replacements_by_iid: defaultdict[str, dict[str, str]] = defaultdict(dict)
+    for (iid, source), mapping in mapping_by_key.items():
+        replacements_by_iid[iid][source] = mapping.short_name
+
+    # Задачи правим на месте: исходный список после переписывания никому не нужен.
+    # Поля приводим к строкам, как и раньше: в jsonl может оказаться null.
     for task in tasks:
         internal_id = str(task.get("internal_id", "")).strip()
-        replacements: dict[str, str] = {
-            source: mapping.short_name
-            for (iid, source), mapping in mapping_by_key.items()
-            if iid == internal_id
-        }
+        replacements = replacements_by_iid.get(internal_id, {})
 
-        new_task = dict(task)
-        new_images: list[dict[str, str]] = []
-        for img in task.get("images", []):
+        for img in task.setdefault("images", []):
             src = str(img.get("src", ""))
-            new_src = replacements.get(src, src)
-            new_images.append({"src": new_src, "alt": str(img.get("alt", ""))})
-        new_task["images"] = new_images
+            img["src"] = replacements.get(src, src)
+            img["alt"] = str(img.get("alt", ""))
 
-        new_attachments: list[dict[str, str]] = []
-        for att in task.get("attachments", []):
+        for att in task.setdefault("attachments", []):
             href = str(att.get("href", ""))
-            new_href = replacements.get(href, href)
-            new_attachments.append({"href": new_href, "text": str(att.get("text", ""))})
-        new_task["attachments"] = new_attachments
+            att["href"] = replacements.get(href, href)
+            att["text"] = str(att.get("text", ""))
 
         question_html = str(task.get("question_html", ""))
-        for source, short_name in replacements.items():
-            if source in question_html:
-                question_html = question_html.replace(source, short_name)
-        new_task["question_html"] = question_html
+        if replacements:
+            question_html = replace_sources(question_html, replacements)
+        task["question_html"] = question_html
 
-        updated.append(new_task)
-    return updated
+    return tasks
 
 
 def write_tasks(tasks: list[dict], output_path: Path) -> None:
-    with output_path.open("w", encoding="utf-8") as f:
-        for task in tasks:
-            f.write(json.dumps(task, ensure_ascii=False) + "\n")
+    # Собираем весь файл в памяти и пишем одним вызовом вместо записи построчно.
+    encode = JSONL_ENCODER.encode
+    output_path.write_text("".join(encode(task) + "\n" for task in tasks), encoding="utf-8")
 
 
 def download_all(
     entries: list[AssetMapping],
     max_files: int | None = None,
     filter_substr: str | None = None,
+    workers: int = DOWNLOAD_WORKERS,
 ) -> None:
-    session = requests.Session()
-    session.headers.update({"User-Agent": USER_AGENT})
-    session.verify = not SKIP_SSL_VERIFY
-    if SKIP_SSL_VERIFY:
-        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)  # type: ignore[attr-defined]
-
-    downloaded = 0
-    for entry in entries:
-        if filter_substr and filter_substr not in entry.source_url:
-            continue
-        if max_files is not None and downloaded >= max_files:
-            print(f"Достигнут лимит {max_files} файлов, останавливаюсь.")
-            break
-
-        target = entry.saved_path
-        if target.exists():
-            continue
-        url = normalize_url(entry.source_url)
-        if not url:
-            print(f"Пропускаю некорректную ссылку: {entry.source_url}")
-            continue
-        target.parent.mkdir(parents=True, exist_ok=True)
-        urls_to_try = [url]
-        if "/bank/" in url:
-            urls_to_try.append(url.replace("/bank/", "/"))
-
-        content: bytes | None = None
-        last_status: int | None = None
-        for candidate in urls_to_try:
-            try:
-                resp = session.get(candidate, timeout=30)
-            except requests.RequestException as exc:
-                print(f"Ошибка загрузки {candidate}: {exc}")
-                continue
-            last_status = resp.status_code
-            if resp.status_code == 200:
-                content = resp.content
-                url = candidate
-                break
-        if content is None:
-            status_info = f"статус {last_status}" if last_status is not None else "нет ответа"
-            print(f"Не удалось скачать {url} ({status_info})")
-            continue
-        target.write_bytes(content)
-        downloaded += 1
-        print(f"Сохранено {target} из {url} ({len(content)} байт)")
+    downloaded = download_entries(
+        entries, max_files=max_files, filter_substr=filter_substr, workers=workers
+    )
+    print(f"Скачано файлов: {downloaded}")
 
 
 def main() -> None:
@@ -240,6 +177,12 @@ def main() -> None:
         description="Скачать вложения и картинки из tasks.jsonl с переименованием по internal_id"
     )
     parser.add_argument("--max", type=int, default=None, help="Лимит числа скачиваемых файлов")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DOWNLOAD_WORKERS,
+        help=f"Число параллельных загрузок (по умолчанию {DOWNLOAD_WORKERS})",
+    )
     parser.add_argument(
         "--filter",
         dest="filter_substr",
@@ -300,7 +243,12 @@ def main() -> None:
     write_map(entries, args.map_path)
     print(f"Сохранён мэппинг: {args.map_path} ({len(entries)} элементов)")
 
-    download_all(entries, max_files=args.max, filter_substr=args.filter_substr)
+    download_all(
+        entries,
+        max_files=args.max,
+        filter_substr=args.filter_substr,
+        workers=max(1, args.workers),
+    )
 
     output_tasks_path = args.rewrite_tasks_path
     if args.inplace:
@@ -1,39 +1,39 @@
 from __future__ import annotations
 
+import argparse
 import math
-import os
 import re
 import sys
-import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
 
 import requests
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+
+from asset_fetch import make_session
 
 PROJ_ID = "B9ACA5BBB2E19E434CD6BEC25284C67F"
 PAGESIZE = 100
 BASE_URL = "https://ege.fipi.ru/bank/questions.php"
-USER_AGENT = (
-    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
-    "(KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
-)
-RETRIES = 3
-RETRY_DELAY = 2
 FALLBACK_MAX_PAGES = 31  # страницы 0..30
-SKIP_SSL_VERIFY = os.environ.get("FIPI_SKIP_SSL_VERIFY", "0") not in {"0", "", "false", "False"}
+DOWNLOAD_WORKERS = 8
+# Порядок важен: сначала самый надёжный источник (вызов setQCount в скрипте страницы).
+TOTAL_TASKS_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE | re.DOTALL)
+    for pattern in (
+        r"setQCount\(\s*(\d+)",
+        r"показаны\s+задани[яе]\s+[^<]{0,50}?\sиз\s+(\d+)",
+        r"из\s+(\d+)\s+задан",
+    )
+]
 
 
 def get_total_tasks(html: str) -> int | None:
     """
     Ищет в HTML число общего количества заданий (по паттерну «из <число>»).
     """
-    patterns = [
-        r"setQCount\(\s*(\d+)",
-        r"показаны\s+задани[яе]\s+[^<]{0,50}?\sиз\s+(\d+)",
-        r"из\s+(\d+)\s+задан",
-    ]
-    for pat in patterns:
-        match = re.search(pat, html, flags=re.IGNORECASE | re.DOTALL)
+    for pattern in TOTAL_TASKS_PATTERNS:
+        match = pattern.search(html)
         if match:
             try:
                 return int(match.group(1))
@@ -42,34 +42,53 @@ def get_total_tasks(html: str) -> int | None:
     return None
 
 
-def download_page(session: requests.Session, page: int) -> str:
+def decode_page(data: bytes) -> str:
+    """Страницы ФИПИ отдаются в cp1251, но уже сохранённые ранее могут быть в UTF-8."""
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("cp1251", errors="replace")
+
+
+def download_page(session: requests.Session, page: int) -> bytes:
     params = {
         "proj": PROJ_ID,
         "page": page,
         "pagesize": PAGESIZE,
     }
-    for attempt in range(1, RETRIES + 1):
-        resp = session.get(BASE_URL, params=params, timeout=15)
-        if resp.status_code == 200:
-            resp.encoding = resp.apparent_encoding or "cp1251"
-            return resp.text
-        if attempt < RETRIES:
-            time.sleep(RETRY_DELAY)
+    resp = session.get(BASE_URL, params=params, timeout=15)
+    if resp.status_code == 200:
+        # Сохраняем байты как есть: без угадывания кодировки (chardet по всей странице)
+        # и без перекодирования при записи. parse_fipi_pages сам разбирает cp1251/UTF-8.
+        return resp.content
     raise RuntimeError(f"Не удалось скачать страницу {page}: статус {resp.status_code}")
 
 
+def load_page(session: requests.Session, output_dir: Path, page: int, reuse: bool) -> bytes:
+    """Берёт страницу с диска, если она уже скачана и разрешено переиспользование."""
+    file_path = output_dir / f"page_{page}.html"
+    if reuse and file_path.exists():
+        return file_path.read_bytes()
+    return download_page(session, page)
+
+
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Скачать страницы банка заданий ФИПИ")
+    parser.add_argument(
+        "--reuse-existing",
+        action="store_true",
+        help="Не перекачивать страницы, которые уже лежат в pages/ (удобно при повторных запусках)",
+    )
+    args = parser.parse_args()
+    reuse: bool = args.reuse_existing
+
     output_dir = Path.cwd() / "pages"
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    session = requests.Session()
-    session.headers.update({"User-Agent": USER_AGENT})
-    session.verify = not SKIP_SSL_VERIFY
-    if SKIP_SSL_VERIFY:
-        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+    session = make_session(pool_size=DOWNLOAD_WORKERS)
 
-    first_html = download_page(session, 0)
-    total_tasks = get_total_tasks(first_html)
+    first_page = load_page(session, output_dir, 0, reuse)
+    total_tasks = get_total_tasks(decode_page(first_page))
 
     if total_tasks is not None:
         total_pages = math.ceil(total_tasks / PAGESIZE)
@@ -82,20 +101,29 @@ def main() -> None:
         total_pages = FALLBACK_MAX_PAGES
 
     downloaded = 0
-    cache = {0: first_html}
 
-    for page in range(total_pages):
-        html = cache.get(page)
-        if html is None:
-            html = download_page(session, page)
+    if total_tasks is not None:
+        # Число страниц известно заранее — остальные страницы качаем параллельно.
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            rest = executor.map(
+                lambda page: (page, load_page(session, output_dir, page, reuse)),
+                range(1, total_pages),
+            )
+            for page, data in chain([(0, first_page)], rest):
+                file_path = output_dir / f"page_{page}.html"
+                file_path.write_bytes(data)
+                downloaded += 1
+    else:
+        for page in range(total_pages):
+            data = first_page if page == 0 else load_page(session, output_dir, page, reuse)
 
-        if total_tasks is None:
+            html = decode_page(data)
             if not html.strip() or "Заданий не найдено" in html:
                 break
 
-        file_path = output_dir / f"page_{page}.html"
-        file_path.write_text(html, encoding="utf-8")
-        downloaded += 1
+            file_path = output_dir / f"page_{page}.html"
+            file_path.write_bytes(data)
+            downloaded += 1
 
     print(f"Скачано страниц: {downloaded}")
     print(f"Путь к папке: {output_dir.resolve()}")
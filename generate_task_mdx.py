@@ -13,13 +13,18 @@
 Запуск:
     uv run python generate_task_mdx.py --internal-id 09DBe5
     uv run python generate_task_mdx.py --task-number 5 --overwrite
+    uv run python generate_task_mdx.py --all --overwrite --workers 8
 """
 
 from __future__ import annotations
 
 import argparse
+import io
 import json
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
@@ -27,20 +32,64 @@ from bs4 import BeautifulSoup, NavigableString, Tag
 
 from transform_tasks import html_to_markdown
 
+INTERNAL_ID_BYTES_RE = re.compile(rb'"internal_id"\s*:\s*"([^"]+)"')
+# Версия формата sidecar-индекса `<input>.idx`: входит в штамп, старые индексы пересобираются.
+OFFSET_INDEX_VERSION = 2
+TEX_SCRIPT_OPS = {"sub": "_", "sup": "^"}
+SUB_SUP_TAG_RE = re.compile(r"<su[bp]\b", re.IGNORECASE)
 SUB_SUP_BASE_RE = re.compile(r"([0-9A-Za-zА-Яа-я]+)\s*$")
+# `$$...$$` проверяем раньше `$...$`; экранированный `\$` не открывает и не закрывает формулу.
+MATH_SPAN_RE = re.compile(
+    r"(?<!\\)(?:\$\$(?:.*?(?<!\\)\$\$|.*)|\$(?:.*?(?<!\\)\$|.*))", re.DOTALL
+)
+MATH_ONLY_RE = re.compile(r"\$[^$]+\$")
+# Fenced-блок целиком: строка-открытие, содержимое и строка-закрытие с тем же маркером
+# (незакрытый блок тянется до конца). Границы строк — как у str.splitlines().
+_LINE_SEPS = r"\n\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029"
+_LINE_START = rf"(?:^|(?<=[{_LINE_SEPS}]))"
+OTHER_LINE_SEP_RE = re.compile(r"[\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029]")
+_LINE_REST = rf"[^{_LINE_SEPS}]*(?:\r\n|[{_LINE_SEPS}])?"
+FENCE_BLOCK_RE = re.compile(
+    rf"{_LINE_START}(?P<fence>```|~~~){_LINE_REST}"
+    rf"(?:.*?{_LINE_START}(?P=fence){_LINE_REST}|.*)",
+    re.MULTILINE | re.DOTALL,
+)
 INLINE_CODE_RE = re.compile(r"(?P<fence>`+)(?P<code>[^`]*?)(?P=fence)")
 MATH_EQ_MATH_RE = re.compile(r"\$(?P<a>[^$\n]+?)\$\s*=\s*\$(?P<b>[^$\n]+?)\$")
 NUM_EQ_MATH_RE = re.compile(r"(?P<a>\b\d+\b)\s*=\s*\$(?P<b>[^$\n]+?)\$")
 MATH_EQ_NUM_RE = re.compile(r"\$(?P<a>[^$\n]+?)\$\s*=\s*(?P<b>\b\d+\b)")
-SINGLE_LEADING_SPACE_RE = re.compile(r"(?m)^ (?![ \t])")
+# Любое из трёх равенств выше — одним сканом, чтобы не гонять цикл по строкам без них.
+ANY_EQ_RE = re.compile(
+    r"\$[^$\n]+?\$\s*=\s*(?:\$[^$\n]+?\$|\b\d+\b)|\b\d+\b\s*=\s*\$[^$\n]+?\$"
+)
 LETTER_ITEM_RE = re.compile(r"^(?P<label>[A-Za-zА-Яа-яЁё])\)\s*(?P<rest>.+)$")
+# Грубая проверка «есть ли вообще строка, начинающаяся с `а)`» — с запасом по разделителям
+# строк, которые понимает str.splitlines().
+LETTER_ITEM_LINE_RE = re.compile(
+    r"(?:^|[\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029])\s*[A-Za-zА-Яа-яЁё]\)", re.MULTILINE
+)
 ORDERED_ITEM_RE = re.compile(r"^(?P<indent>[ \t]*)(?:\d+[.)])\s+")
+# То же для строки, от которой отрезан завершающий `\n`: пробелы после маркера могут кончаться им.
+ORDERED_ITEM_EOL_RE = re.compile(r"^(?P<indent>[ \t]*)(?:\d+[.)])(?:\s+|\Z)")
 ORDERED_MARKER_NORMALIZE_RE = re.compile(
     r"^(?P<indent>[ \t]*)(?P<num>\d+)[.)][ \t]+(?P<rest>.*)$",
 )
+# Есть ли хоть одна строка, которую ORDERED_MARKER_NORMALIZE_RE может изменить.
+ORDERED_MARKER_LINE_RE = re.compile(rf"{_LINE_START}[ \t]*\d+[.)][ \t]", re.MULTILINE)
 COMMA_SOFTBREAK_RE = re.compile(r",[ \t]*\r?\n(?=[a-zа-яё])")
+# Одиночный пробел в начале строки (убираем) и COMMA_SOFTBREAK_RE — за один проход;
+# перенос после запятой склеиваем и тогда, когда продолжение начинается с такого пробела.
+LEADING_SPACE_OR_SOFTBREAK_RE = re.compile(
+    r"(?P<comma>,[ \t]*\r?\n(?: (?![ \t]))?(?=[a-zа-яё]))|(?m:^ (?![ \t]))"
+)
 TASK5_ITALIC_VARS = {"N", "R"}
+TASK5_VAR_RE = re.compile(
+    r"\*(" + "|".join(re.escape(v) for v in sorted(TASK5_ITALIC_VARS)) + r")\*"
+)
 TASK5_NUMBER_TOKEN_RE = re.compile(r"(?<![0-9A-Za-zА-Яа-я_])\d+(?![0-9A-Za-zА-Яа-я_])")
+TASK5_PLAIN_TOKEN_RE = re.compile(
+    r"(?P<tag><[^>]*>?)|(?P<link>\]\()|(?P<num>" + TASK5_NUMBER_TOKEN_RE.pattern + ")"
+)
 TASK5_BROKEN_ITALIC_VAR_WITH_FOLLOW_RE = re.compile(
     r"\*(?P<var>[NR])\s+\*(?P<next>[A-Za-zА-Яа-яЁё])",
 )
@@ -56,6 +105,12 @@ def parse_args() -> argparse.Namespace:
         type=int,
         help="сгенерировать все задачи с указанным номером из internal_id_to_task_number.json",
     )
+    group.add_argument(
+        "--internal-ids-file",
+        type=Path,
+        help="файл со списком internal_id (по одному в строке) для пакетной генерации",
+    )
+    group.add_argument("--all", action="store_true", help="сгенерировать все задачи из --input")
     parser.add_argument("--input", type=Path, default=Path("tasks_clean.jsonl"))
     parser.add_argument(
         "--output-dir",
@@ -64,15 +119,80 @@ def parse_args() -> argparse.Namespace:
         help="куда писать *.mdx",
     )
     parser.add_argument("--overwrite", action="store_true", help="перезаписать файл, если уже есть")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="число процессов для пакетной генерации",
+    )
     return parser.parse_args()
 
 
+def _index_path(input_path: Path) -> Path:
+    return input_path.with_name(input_path.name + ".idx")
+
+
+def build_offset_index(input_path: Path) -> dict[str, list[int]]:
+    """Строит индекс INTERNAL_ID (UPPER) -> смещения его строк в jsonl без разбора JSON.
+
+    Смещения идут в порядке файла: повторы internal_id тоже попадают в индекс.
+    """
+    offsets: dict[str, list[int]] = {}
+    offset = 0
+    with input_path.open("rb") as f:
+        for line in f:
+            # Первое вхождение — верхнеуровневый internal_id (meta идёт в строке позже).
+            match = INTERNAL_ID_BYTES_RE.search(line)
+            if match:
+                offsets.setdefault(match.group(1).decode("utf-8").upper(), []).append(offset)
+            offset += len(line)
+    return offsets
+
+
+def load_offset_index(input_path: Path, *, rebuild: bool = False) -> dict[str, list[int]]:
+    """Индекс из sidecar-файла `<input>.idx`; пересобирается, если jsonl изменился.
+
+    В штампе кроме mtime и size есть ctime: его нельзя вернуть назад, поэтому перезапись
+    файла на месте с тем же размером и восстановленным mtime тоже сбрасывает индекс.
+    """
+    stat = input_path.stat()
+    stamp = [OFFSET_INDEX_VERSION, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size]
+    idx_path = _index_path(input_path)
+    if not rebuild:
+        try:
+            cached = json.loads(idx_path.read_bytes())
+            if cached.get("stamp") == stamp:
+                return cached["offsets"]
+        except (OSError, ValueError, AttributeError, KeyError):
+            pass
+
+    offsets = build_offset_index(input_path)
+    try:
+        idx_path.write_text(json.dumps({"stamp": stamp, "offsets": offsets}), encoding="utf-8")
+    except OSError:
+        pass
+    return offsets
+
+
 def load_task(input_path: Path, internal_id: str) -> dict[str, Any]:
     target = internal_id.strip().lower()
-    with input_path.open("r", encoding="utf-8") as f:
+
+    offsets = load_offset_index(input_path).get(target.upper())
+    if offsets:
+        with input_path.open("rb") as f:
+            f.seek(offsets[0])
+            row = json.loads(f.readline())
+        if str(row.get("internal_id", "")).lower() == target:
+            return row
+
+    # Индекс не помог (например, нестандартная строка) — ищем линейным проходом.
+    # Дешёвый префильтр по сырой строке: JSON целиком разбираем только у строк-кандидатов.
+    needle = re.compile(
+        rb'"internal_id"\s*:\s*"' + re.escape(target.encode("utf-8")) + rb'"', re.IGNORECASE
+    )
+    with input_path.open("rb") as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if not needle.search(line):
                 continue
             row = json.loads(line)
             if str(row.get("internal_id", "")).lower() == target:
@@ -92,11 +212,17 @@ def load_tasks_for_internal_ids(
     if not targets:
         return {}
 
+    # JSON разбираем только у строк, где встречается один из искомых internal_id.
+    needle = re.compile(
+        rb'"internal_id"\s*:\s*"\s*(?:'
+        + b"|".join(re.escape(t.encode("utf-8")) for t in sorted(targets))
+        + rb')\s*"',
+        re.IGNORECASE,
+    )
     found: dict[str, dict[str, Any]] = {}
-    with input_path.open("r", encoding="utf-8") as f:
+    with input_path.open("rb") as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if not needle.search(line):
                 continue
             row = json.loads(line)
             row_id = str(row.get("internal_id", "")).strip()
@@ -112,14 +238,50 @@ def load_tasks_for_internal_ids(
     return found
 
 
+def load_all_tasks(input_path: Path) -> dict[str, dict[str, Any]]:
+    """Все задачи из jsonl: INTERNAL_ID (UPPER) -> task dict."""
+    found: dict[str, dict[str, Any]] = {}
+    with input_path.open("rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            row_id = str(row.get("internal_id", "")).strip()
+            if row_id:
+                found.setdefault(row_id.upper(), row)
+    return found
+
+
+def read_internal_ids(path: Path) -> set[str]:
+    """Читает internal_id из текстового файла: по одному в строке, `#` — комментарий."""
+    ids: set[str] = set()
+    for line in path.read_text(encoding="utf-8").split("\n"):
+        item = line.split("#", 1)[0].strip()
+        if item:
+            ids.add(item.upper())
+    return ids
+
+
 def load_task_number_map(
     path: Path = Path("internal_id_to_task_number.json"),
 ) -> dict[str, int | None]:
-    """Читает маппинг internal_id -> номер задачи (например, 5)."""
-    if not path.exists():
+    """Читает маппинг internal_id -> номер задачи (например, 5).
+
+    Результат кэшируется по (путь, mtime): повторные вызовы не перечитывают файл.
+    Возвращаемый dict общий для всех вызовов — не изменяйте его.
+    """
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
         return {}
+    return _load_task_number_map(str(path), mtime_ns)
+
+
+@lru_cache(maxsize=4)
+def _load_task_number_map(path_str: str, mtime_ns: int) -> dict[str, int | None]:
+    path = Path(path_str)
     try:
-        raw = json.loads(path.read_text(encoding="utf-8"))
+        raw = json.loads(path.read_bytes())
     except json.JSONDecodeError:
         return {}
     if not isinstance(raw, dict):
@@ -139,113 +301,75 @@ def load_task_number_map(
     return mapping
 
 
+def load_internal_ids_by_task_number(
+    path: Path = Path("internal_id_to_task_number.json"),
+) -> dict[int, frozenset[str]]:
+    """Обратный маппинг: номер задачи -> INTERNAL_ID (UPPER); кэшируется как и прямой."""
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    return _load_internal_ids_by_task_number(str(path), mtime_ns)
+
+
+@lru_cache(maxsize=4)
+def _load_internal_ids_by_task_number(path_str: str, mtime_ns: int) -> dict[int, frozenset[str]]:
+    grouped: dict[int, set[str]] = {}
+    for internal_id, number in _load_task_number_map(path_str, mtime_ns).items():
+        if number is not None:
+            grouped.setdefault(number, set()).add(internal_id)
+    return {number: frozenset(ids) for number, ids in grouped.items()}
+
+
 def convert_task5_vars_to_math(text: str) -> str:
     """Для задач №5: `*N*`/`*R*` -> `$N$`/`$R$` (формульный курсив)."""
-    for var in TASK5_ITALIC_VARS:
-        text = text.replace(f"*{var}*", f"${var}$")
-    return text
+    return TASK5_VAR_RE.sub(r"$\1$", text)
 
 
 def _split_by_math_spans(text: str) -> list[tuple[str, bool]]:
     """Разбивает строку на сегменты «текст/математика».
 
-    Нужно, чтобы не трогать содержимое `$...$`/`$$...$$`.
+    Нужно, чтобы не трогать содержимое `$...$`/`$$...$$`. Незакрытая формула тянется
+    до конца строки и тоже считается математикой.
     """
     if not text:
         return [("", False)]
 
     segments: list[tuple[str, bool]] = []
-    buf: list[str] = []
-    mode: str = "text"  # text | inline | display
-
-    def flush(is_math: bool) -> None:
-        nonlocal buf
-        if not buf:
-            return
-        segments.append(("".join(buf), is_math))
-        buf = []
-
-    i = 0
-    n = len(text)
-    while i < n:
-        ch = text[i]
-
-        if mode == "text":
-            if (
-                ch == "$"
-                and i + 1 < n
-                and text[i : i + 2] == "$$"
-                and (i == 0 or text[i - 1] != "\\")
-            ):
-                flush(False)
-                mode = "display"
-                buf.append("$$")
-                i += 2
-                continue
-            if ch == "$" and (i == 0 or text[i - 1] != "\\"):
-                flush(False)
-                mode = "inline"
-                buf.append("$")
-                i += 1
-                continue
-
-            buf.append(ch)
-            i += 1
-            continue
-
-        if mode == "inline":
-            buf.append(ch)
-            if ch == "$" and text[i - 1] != "\\":
-                flush(True)
-                mode = "text"
-            i += 1
-            continue
-
-        if mode == "display":
-            if (
-                ch == "$"
-                and i + 1 < n
-                and text[i : i + 2] == "$$"
-                and (i == 0 or text[i - 1] != "\\")
-            ):
-                buf.append("$$")
-                i += 2
-                flush(True)
-                mode = "text"
-                continue
-
-            buf.append(ch)
-            i += 1
-            continue
-
-    flush(mode != "text")
+    last = 0
+    for match in MATH_SPAN_RE.finditer(text):
+        if match.start() > last:
+            segments.append((text[last : match.start()], False))
+        segments.append((match.group(0), True))
+        last = match.end()
+    if last < len(text):
+        segments.append((text[last:], False))
     return segments
 
 
 def _wrap_numbers_in_plain_text(text: str) -> str:
     """Оборачивает числа в `$...$`, стараясь не ломать ссылки и raw HTML."""
-    if not text:
+    # Без единого числа-токена обходить теги и ссылки незачем — результат совпадёт с входом.
+    if not text or not TASK5_NUMBER_TOKEN_RE.search(text):
         return text
 
     out: list[str] = []
-    i = 0
+    pos = 0
     n = len(text)
-    while i < n:
-        ch = text[i]
-
-        # Raw HTML tag: <...>
-        if ch == "<":
-            j = text.find(">", i + 1)
-            if j == -1:
-                out.append(text[i:])
-                break
-            out.append(text[i : j + 1])
-            i = j + 1
+    # Ищем только «интересные» места (тег, адрес ссылки, число), остальное копируем срезами.
+    while (match := TASK5_PLAIN_TOKEN_RE.search(text, pos)) is not None:
+        start = match.start()
+        out.append(text[pos:start])
+
+        # Raw HTML tag: <...> (незакрытый тег тянется до конца строки)
+        if match.lastgroup == "tag":
+            out.append(match.group(0))
+            pos = match.end()
             continue
 
-        # Markdown link/image destination: ](...)
-        if ch == "]" and i + 1 < n and text[i + 1] == "(":
-            j = i + 2
+        # Markdown link/image destination: ](...) со вложенными скобками
+        if match.lastgroup == "link":
+            j = start + 2
             depth = 1
             while j < n and depth:
                 if text[j] == "(":
@@ -253,19 +377,14 @@ def _wrap_numbers_in_plain_text(text: str) -> str:
                 elif text[j] == ")":
                     depth -= 1
                 j += 1
-            out.append(text[i:j])
-            i = j
-            continue
-
-        m = TASK5_NUMBER_TOKEN_RE.match(text, i)
-        if m:
-            out.append(f"${m.group(0)}$")
-            i = m.end()
+            out.append(text[start:j])
+            pos = j
             continue
 
-        out.append(ch)
-        i += 1
+        out.append(f"${match.group(0)}$")
+        pos = match.end()
 
+    out.append(text[pos:])
     return "".join(out)
 
 
@@ -278,24 +397,30 @@ def convert_task5_numbers_to_math(markdown: str) -> str:
             out.append(seg)
             continue
 
-        # Не ломаем маркеры нумерованных списков (1./2./3.) — оставляем префикс как есть.
-        lines = seg.splitlines(keepends=True)
-        for line in lines:
-            marker = ORDERED_ITEM_RE.match(line)
-            if not marker:
-                out.append(_wrap_numbers_in_plain_text(line))
-                continue
+        if OTHER_LINE_SEP_RE.search(seg):
+            out.extend(
+                _wrap_numbers_in_line(line, ORDERED_ITEM_RE)
+                for line in seg.splitlines(keepends=True)
+            )
+            continue
 
-            prefix = line[: marker.end()]
-            rest = line[marker.end() :]
-            out.append(prefix + _wrap_numbers_in_plain_text(rest))
+        # Частый случай — только `\n`: режем без keepends. Конец строки у всех кусков, кроме
+        # последнего, подразумевается, поэтому маркер может заканчиваться прямо на нём.
+        lines = seg.split("\n")
+        last = lines.pop()
+        wrapped = [_wrap_numbers_in_line(line, ORDERED_ITEM_EOL_RE) for line in lines]
+        wrapped.append(_wrap_numbers_in_line(last, ORDERED_ITEM_RE))
+        out.append("\n".join(wrapped))
 
     return "".join(out)
 
 
-def _as_tex_script(kind: str, text: str) -> str:
-    op = "_" if kind == "sub" else "^"
-    return f"{op}{{{text}}}"
+def _wrap_numbers_in_line(line: str, marker_re: re.Pattern[str]) -> str:
+    # Не ломаем маркеры нумерованных списков (1./2./3.) — оставляем префикс как есть.
+    marker = marker_re.match(line)
+    if not marker:
+        return _wrap_numbers_in_plain_text(line)
+    return line[: marker.end()] + _wrap_numbers_in_plain_text(line[marker.end() :])
 
 
 def convert_sub_sup_to_tex(html: str) -> str:
@@ -304,11 +429,15 @@ def convert_sub_sup_to_tex(html: str) -> str:
     Пример:
         `111<sub>10</sub>` -> `$111_{10}$`
     """
+    # Без <sub>/<sup> (а это ~90% задач) разбирать HTML незачем.
+    if not SUB_SUP_TAG_RE.search(html):
+        return html
 
     soup = BeautifulSoup(f"<root>{html}</root>", "html.parser")
     root = soup.find("root") or soup
 
-    for tag in list(root.find_all(["sub", "sup"])):
+    # find_all уже отдаёт готовый список, так что замены по ходу обхода ему не мешают.
+    for tag in root.find_all(["sub", "sup"]):
         kind = tag.name or ""
         script_text = tag.get_text(strip=True)
         if not script_text:
@@ -319,7 +448,7 @@ def convert_sub_sup_to_tex(html: str) -> str:
         while isinstance(base_node, NavigableString) and base_node.strip() == "":
             base_node = base_node.previous_sibling
 
-        script = _as_tex_script(kind, script_text)
+        script = f"{TEX_SCRIPT_OPS.get(kind, '^')}{{{script_text}}}"
 
         if base_node is None:
             tag.replace_with(f"${script}$")
@@ -330,7 +459,7 @@ def convert_sub_sup_to_tex(html: str) -> str:
             stripped = text.strip()
 
             # Если прямо перед sub/sup уже стоит `$...$`, аккуратно дописываем скрипт внутрь.
-            if re.fullmatch(r"\$[^$]+\$", stripped):
+            if MATH_ONLY_RE.fullmatch(stripped):
                 inner = stripped[1:-1]
                 new_math = f"${inner}{script}$"
                 base_node.replace_with(text.replace(stripped, new_math, 1))
@@ -364,6 +493,10 @@ def convert_sub_sup_to_tex(html: str) -> str:
     return "".join(str(child) for child in root.contents)
 
 
+def _join_equality(match: re.Match[str]) -> str:
+    return f"${match.group('a').strip()} = {match.group('b').strip()}$"
+
+
 def _merge_equals_in_text(text: str) -> str:
     """Склеивает равенства в один `$...$`, чтобы не было смешения шрифтов (math/text).
 
@@ -373,36 +506,40 @@ def _merge_equals_in_text(text: str) -> str:
         `$1100100_{2}$ = 100` -> `$1100100_{2} = 100$`
     """
 
-    prev = None
+    if "=" not in text or not ANY_EQ_RE.search(text):
+        return text
+
     merged = text
-    while prev != merged:
-        prev = merged
-        merged = MATH_EQ_MATH_RE.sub(
-            lambda m: f"${m.group('a').strip()} = {m.group('b').strip()}$",
-            merged,
-        )
-        merged = NUM_EQ_MATH_RE.sub(
-            lambda m: f"${m.group('a').strip()} = {m.group('b').strip()}$",
-            merged,
-        )
-        merged = MATH_EQ_NUM_RE.sub(
-            lambda m: f"${m.group('a').strip()} = {m.group('b').strip()}$",
-            merged,
-        )
+    changed = 1
+    while changed:
+        merged, n1 = MATH_EQ_MATH_RE.subn(_join_equality, merged)
+        merged, n2 = NUM_EQ_MATH_RE.subn(_join_equality, merged)
+        merged, n3 = MATH_EQ_NUM_RE.subn(_join_equality, merged)
+        changed = n1 + n2 + n3
     return merged
 
 
+def _leading_space_or_softbreak(match: re.Match[str]) -> str:
+    return ", " if match.group("comma") else ""
+
+
 def _transform_outside_inline_code(text: str, task_number: int | None) -> str:
     if not text:
         return text
 
-    text = SINGLE_LEADING_SPACE_RE.sub("", text)
-    text = normalize_comma_softbreaks(text)
+    if " " in text:
+        text = LEADING_SPACE_OR_SOFTBREAK_RE.sub(_leading_space_or_softbreak, text)
+    else:
+        text = normalize_comma_softbreaks(text)
     text = normalize_ordered_list_markers(text)
     if task_number == 5:
         text = normalize_task5_broken_italic_vars(text)
     text = normalize_letter_subpoints(text)
 
+    # Дальше только склейка равенств и правки №5 — без `=` для прочих задач делать нечего.
+    if task_number != 5 and "=" not in text:
+        return text
+
     parts: list[str] = []
     last = 0
     for match in INLINE_CODE_RE.finditer(text):
@@ -428,7 +565,7 @@ def normalize_comma_softbreaks(markdown: str) -> str:
     становится переносом строки. Склеиваем только когда новая строка начинается со
     строчной буквы (то есть это почти наверняка продолжение предложения).
     """
-    if not markdown:
+    if "," not in markdown:
         return markdown
     return COMMA_SOFTBREAK_RE.sub(", ", markdown)
 
@@ -439,7 +576,7 @@ def normalize_ordered_list_markers(markdown: str) -> str:
     Приводит строки вида `1)    Текст` и `1.    Текст` к каноническому `1. Текст`.
     Это стабилизирует отступы подпунктов (`а)`/`б)`), которые зависят от длины маркера.
     """
-    if not markdown:
+    if not markdown or not ORDERED_MARKER_LINE_RE.search(markdown):
         return markdown
 
     lines = markdown.splitlines(keepends=True)
@@ -485,6 +622,13 @@ def normalize_task5_broken_italic_vars(markdown: str) -> str:
     return fixed
 
 
+def _join_lines(lines: list[str], ends_with_newline: bool) -> str:
+    result = "\n".join(lines)
+    if ends_with_newline and not result.endswith("\n"):
+        result += "\n"
+    return result
+
+
 def normalize_letter_subpoints(markdown: str) -> str:
     """Преобразует параграфы вида `а) ...`/`б) ...` в подпункты.
 
@@ -505,6 +649,9 @@ def normalize_letter_subpoints(markdown: str) -> str:
     lines = markdown.splitlines()
     ends_with_newline = markdown.endswith("\n")
 
+    if not LETTER_ITEM_LINE_RE.search(markdown):
+        return _join_lines(lines, ends_with_newline)
+
     out: list[str] = []
     prev_nonblank: str | None = None
 
@@ -591,10 +738,7 @@ def normalize_letter_subpoints(markdown: str) -> str:
 
         i = k
 
-    result = "\n".join(out)
-    if ends_with_newline and not result.endswith("\n"):
-        result += "\n"
-    return result
+    return _join_lines(out, ends_with_newline)
 
 
 def normalize_math_in_markdown(markdown: str, *, task_number: int | None) -> str:
@@ -602,41 +746,15 @@ def normalize_math_in_markdown(markdown: str, *, task_number: int | None) -> str
     if not markdown:
         return markdown
 
-    lines = markdown.splitlines(keepends=True)
     out: list[str] = []
-    buffer: list[str] = []
-    in_fence = False
-    fence: str | None = None
-
-    def flush_buffer() -> None:
-        nonlocal buffer
-        if not buffer:
-            return
-        out.append(_transform_outside_inline_code("".join(buffer), task_number))
-        buffer = []
-
-    for line in lines:
-        fence_match = re.match(r"^(```|~~~)", line)
-        if fence_match:
-            marker = fence_match.group(1)
-            if not in_fence:
-                flush_buffer()
-                in_fence = True
-                fence = marker
-                out.append(line)
-                continue
-            if marker == fence:
-                in_fence = False
-                fence = None
-                out.append(line)
-                continue
-
-        if in_fence:
-            out.append(line)
-        else:
-            buffer.append(line)
-
-    flush_buffer()
+    last = 0
+    for match in FENCE_BLOCK_RE.finditer(markdown):
+        if match.start() > last:
+            out.append(_transform_outside_inline_code(markdown[last : match.start()], task_number))
+        out.append(match.group(0))
+        last = match.end()
+    if last < len(markdown):
+        out.append(_transform_outside_inline_code(markdown[last:], task_number))
     return "".join(out)
 
 
@@ -658,40 +776,42 @@ def to_frontmatter(task: dict[str, Any]) -> str:
     if not internal_id:
         raise ValueError("У задачи отсутствует internal_id")
 
-    lines: list[str] = ["---", f'id: "{internal_id}"', f"answer_type: {answer_type}"]
+    buf = io.StringIO()
+    write = buf.write
+    write(f'---\nid: "{internal_id}"\nanswer_type: {answer_type}\n')
 
     if kes_codes:
-        lines.append("kes:")
+        write("kes:\n")
         for code in kes_codes:
-            lines.append(f'  - "{code}"')
+            write(f'  - "{code}"\n')
     else:
-        lines.append("kes: []")
+        write("kes: []\n")
 
     if hint.strip():
-        lines.append("hint: |")
+        write("hint: |\n")
         for hline in hint.rstrip("\n").splitlines():
-            lines.append(f"  {hline}")
+            write(f"  {hline}\n")
     else:
-        lines.append('hint: ""')
+        write('hint: ""\n')
 
     if answer_type == "single_choice":
-        lines.append("options:")
+        write("options:\n")
         if isinstance(options, list) and options:
             for item in options:
                 value = "" if item is None else str((item or {}).get("value", ""))
                 text = "" if item is None else str((item or {}).get("text", ""))
-                lines.append(f'  - value: "{value}"')
+                write(f'  - value: "{value}"\n')
                 if text.strip():
-                    lines.append("    text: |")
+                    write("    text: |\n")
                     for tline in text.rstrip("\n").splitlines():
-                        lines.append(f"      {tline}")
+                        write(f"      {tline}\n")
                 else:
-                    lines.append('    text: ""')
+                    write('    text: ""\n')
         else:
-            lines.append("  []")
+            write("  []\n")
 
-    lines.append("---")
-    return "\n".join(lines) + "\n"
+    write("---\n")
+    return buf.getvalue()
 
 
 def render_task_mdx(task: dict[str, Any], *, task_number: int | None) -> str:
@@ -702,6 +822,38 @@ def render_task_mdx(task: dict[str, Any], *, task_number: int | None) -> str:
     return to_frontmatter(task) + "\n" + body
 
 
+def write_task_mdx(task: dict[str, Any], task_number: int | None, out_path: Path) -> bool:
+    """Пишет MDX; False, если на диске уже ровно такой файл (его mtime не трогаем)."""
+    data = render_task_mdx(task, task_number=task_number).encode("utf-8")
+    try:
+        if out_path.stat().st_size == len(data) and out_path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    out_path.write_bytes(data)
+    return True
+
+
+def write_tasks_mdx(
+    jobs: list[tuple[dict[str, Any], int | None, Path]],
+    *,
+    workers: int,
+) -> int:
+    """Рендерит пачку задач; при workers > 1 — в пуле процессов (BS4 упирается в CPU).
+
+    Возвращает число реально перезаписанных файлов.
+    """
+    if workers <= 1 or len(jobs) < 2:
+        return sum(
+            write_task_mdx(task, task_number, out_path) for task, task_number, out_path in jobs
+        )
+
+    tasks, task_numbers, out_paths = zip(*jobs, strict=True)
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(write_task_mdx, tasks, task_numbers, out_paths, chunksize=chunksize))
+
+
 def main() -> None:
     args = parse_args()
 
@@ -721,46 +873,54 @@ def main() -> None:
         if out_path.exists() and not args.overwrite:
             raise FileExistsError(f"Файл уже существует: {out_path} (используй --overwrite)")
 
-        out_path.write_text(render_task_mdx(task, task_number=task_number), encoding="utf-8")
-        print(f"OK: {out_path}")
+        if write_task_mdx(task, task_number, out_path):
+            print(f"OK: {out_path}")
+        else:
+            print(f"OK: {out_path} (без изменений)")
         return
 
     # batch mode
-    if args.task_number is None:
-        raise ValueError("Ожидался --task-number")
-    requested_number = int(args.task_number)
-    internal_ids = {k for k, v in task_number_map.items() if v == requested_number}
-    if not internal_ids:
-        raise ValueError(
-            f"В internal_id_to_task_number.json нет задач с номером {requested_number}",
-        )
-
-    tasks_by_id = load_tasks_for_internal_ids(args.input, internal_ids)
+    scope = ""
+    if args.all:
+        tasks_by_id = load_all_tasks(args.input)
+        internal_ids = set(tasks_by_id)
+    elif args.internal_ids_file is not None:
+        internal_ids = read_internal_ids(args.internal_ids_file)
+        if not internal_ids:
+            raise ValueError(f"В {args.internal_ids_file} нет ни одного internal_id")
+        tasks_by_id = load_tasks_for_internal_ids(args.input, internal_ids)
+    else:
+        requested_number = int(args.task_number)
+        internal_ids = set(load_internal_ids_by_task_number().get(requested_number, ()))
+        if not internal_ids:
+            raise ValueError(
+                f"В internal_id_to_task_number.json нет задач с номером {requested_number}",
+            )
+        tasks_by_id = load_tasks_for_internal_ids(args.input, internal_ids)
+        scope = f" task_number={requested_number}"
     missing = sorted(internal_ids.difference(tasks_by_id.keys()))
 
-    written = 0
+    jobs: list[tuple[dict[str, Any], int | None, Path]] = []
     skipped = 0
     for internal_id in sorted(tasks_by_id.keys()):
-        task = tasks_by_id[internal_id]
         out_path = out_dir / f"{internal_id}.mdx"
         if out_path.exists() and not args.overwrite:
             skipped += 1
             continue
-        out_path.write_text(
-            render_task_mdx(task, task_number=requested_number),
-            encoding="utf-8",
-        )
-        written += 1
+        jobs.append((tasks_by_id[internal_id], task_number_map.get(internal_id), out_path))
+
+    written = write_tasks_mdx(jobs, workers=args.workers)
+    unchanged = len(jobs) - written
 
     if missing:
         print(
-            f"WARN: {len(missing)} internal_id из маппинга не найдены в {args.input}: "
+            f"WARN: {len(missing)} запрошенных internal_id не найдены в {args.input}: "
             + ", ".join(missing[:20])
             + (" ..." if len(missing) > 20 else ""),
         )
 
     print(
-        f"OK: written={written} skipped={skipped} task_number={requested_number} out_dir={out_dir}",
+        f"OK: written={written} unchanged={unchanged} skipped={skipped}{scope} out_dir={out_dir}"
     )
 
 
@@ -1,18 +1,28 @@
 from __future__ import annotations
 
+import argparse
+import io
 import json
 import os
 import re
-from collections import Counter
-from collections.abc import Iterable
+from collections import Counter, defaultdict
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
 from dataclasses import dataclass
+from itertools import islice
 from pathlib import Path
 from typing import TypedDict
-from urllib.parse import urljoin, urlsplit
+from urllib.parse import urlsplit
 
-import requests
-from bs4 import BeautifulSoup, Tag
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from bs4 import BeautifulSoup, NavigableString, Tag
+
+from asset_fetch import (
+    DOWNLOAD_WORKERS,
+    AssetMapping,
+    download_entries,
+    replace_sources,
+)
 
 ATTACHMENT_EXTENSIONS = (
     ".pdf",
@@ -31,22 +41,30 @@ ATTACHMENT_EXTENSIONS = (
     ".jpeg",
     ".gif",
     ".bmp",
-    ".zip",
-    ".rar",
-    ".7z",
 )
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp")
 
-BASE_CONTEXT_URL = "https://ege.fipi.ru/"
-USER_AGENT = (
-    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
-    "(KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
-)
 ASSETS_DIR = Path("assets")
 MAP_PATH = Path("map.json")
-SKIP_SSL_VERIFY = os.environ.get("FIPI_SKIP_SSL_VERIFY", "0") not in {"0", "", "false", "False"}
+DEFAULT_HINTS = frozenset(
+    {
+        "Впишите правильный ответ.",
+        "Дайте развернутый ответ.",
+        "Дайте развёрнутый ответ.",
+        "Выберите правильный ответ.",
+    }
+)
+# json.dumps(..., ensure_ascii=False) собирает новый JSONEncoder на каждый вызов — держим свой.
+JSONL_ENCODER = json.JSONEncoder(ensure_ascii=False)
+JSONL_WRITE_BATCH = 1024
+QBLOCK_TAG_NAMES = frozenset({"td", "input", "table", "textarea", "select", "div"})
+CELL_TAG_NAMES = frozenset({"img", "script", "a"})
+READ_WORKERS = 8
+SCRIPT_STRING_RE = re.compile(r"'([^']+)'")
+PAGE_FILE_RE = re.compile(r"page_(\d+)\.html")
 
 
-@dataclass
+@dataclass(slots=True)
 class ParsedAttachment:
     href: str
     text: str
@@ -89,22 +107,13 @@ class TaskDict(TypedDict):
     index_on_page: int
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class AssetCandidate:
     internal_id: str
     source: str
     kind: str  # "image" | "attachment"
 
 
-@dataclass(frozen=True)
-class AssetMapping:
-    internal_id: str
-    source_url: str
-    short_name: str
-    saved_path: Path
-    original_name: str
-
-
 def url_extension(url: str) -> str:
     """Возвращает расширение файла из URL/пути без учёта query/fragment."""
     parsed = urlsplit(url.strip())
@@ -126,33 +135,71 @@ def decode_html_bytes(data: bytes) -> str:
         return data.decode("cp1251", errors="replace")
 
 
-def extract_attachments(cell: Tag) -> list[ParsedAttachment]:
+def tag_text(tag: Tag, separator: str = "") -> str:
+    """`get_text(separator, strip=True)` с быстрым путём для тега из одной строки текста."""
+    contents = tag.contents
+    if len(contents) == 1 and type(contents[0]) is NavigableString:
+        return contents[0].strip()
+    return tag.get_text(separator, strip=True)
+
+
+def group_tags(root: Tag, names: frozenset[str]) -> dict[str, list[Tag]]:
+    """Один обход поддерева: теги с нужными именами, разложенные по имени в порядке документа."""
+    grouped: dict[str, list[Tag]] = {name: [] for name in names}
+    for el in root.descendants:
+        if isinstance(el, Tag) and el.name in names:
+            grouped[el.name].append(el)
+    return grouped
+
+
+def has_class(tag: Tag, class_name: str) -> bool:
+    classes = tag.get("class")
+    if classes is None:
+        return False
+    if isinstance(classes, str):
+        return class_name in classes.split()
+    return class_name in classes
+
+
+def find_internal_id_span(info_div: Tag) -> Tag | None:
+    """Аналог `select_one("div.id-text span.canselect")` без CSS-движка."""
+    for span in info_div.find_all("span"):
+        if has_class(span, "canselect") and any(
+            parent.name == "div" and has_class(parent, "id-text") for parent in span.parents
+        ):
+            return span
+    return None
+
+
+def extract_attachments(links: Iterable[Tag]) -> list[ParsedAttachment]:
     attachments: list[ParsedAttachment] = []
-    for a_tag in cell.find_all("a", href=True):
+    for a_tag in links:
+        if a_tag.get("href") is None:
+            continue
         href = attr_to_str(a_tag.get("href"))
         href_lower = href.lower()
         if "docs/" in href_lower or href_lower.endswith(ATTACHMENT_EXTENSIONS):
-            attachments.append(ParsedAttachment(href=href, text=a_tag.get_text(" ", strip=True)))
+            attachments.append(ParsedAttachment(href=href, text=tag_text(a_tag, " ")))
     return attachments
 
 
-def extract_media_from_scripts(cell: Tag) -> tuple[list[dict[str, str]], list[AttachmentDict]]:
+def extract_media_from_scripts(
+    scripts: Iterable[Tag],
+) -> tuple[list[dict[str, str]], list[AttachmentDict]]:
     images: list[dict[str, str]] = []
     attachments: list[AttachmentDict] = []
-    for script in cell.find_all("script"):
+    for script in scripts:
         script_text = script.string or "".join(script.strings)
         if not script_text:
             continue
-        for candidate in re.findall(r"'([^']+)'", script_text):
+        for candidate in SCRIPT_STRING_RE.findall(script_text):
             normalized = candidate.strip()
             if not normalized:
                 continue
             lower = normalized.lower()
-            if any(
-                lower.endswith(ext) for ext in (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp")
-            ):
+            if lower.endswith(IMAGE_EXTENSIONS):
                 images.append({"src": normalized, "alt": ""})
-            elif "docs/" in lower or any(lower.endswith(ext) for ext in ATTACHMENT_EXTENSIONS):
+            elif "docs/" in lower or lower.endswith(ATTACHMENT_EXTENSIONS):
                 attachments.append({"href": normalized, "text": ""})
     return images, attachments
 
@@ -171,7 +218,7 @@ def extract_options(table: Tag) -> tuple[str, list[OptionDict]] | tuple[str, Non
             answer_type = "single_choice"
         value = attr_to_str(input_el.get("value"))
         tds = tr.find_all("td")
-        option_text = tds[-1].get_text(" ", strip=True) if tds else tr.get_text(" ", strip=True)
+        option_text = tag_text(tds[-1], " ") if tds else tag_text(tr, " ")
         options.append({"value": value, "text": option_text})
     if not options:
         return "unknown", None
@@ -183,27 +230,29 @@ def parse_meta_block(info_div: Tag | None, suffix: str) -> MetaDict:
     if not info_div:
         return meta
 
-    task_info = info_div.select_one("div.task-info-content")
+    task_info = next(
+        (div for div in info_div.find_all("div") if has_class(div, "task-info-content")), None
+    )
     if not task_info:
         return meta
 
     for tr in task_info.find_all("tr"):
-        name_td = tr.find("td", class_="param-name")
+        name_td = next((td for td in tr.find_all("td") if has_class(td, "param-name")), None)
         if not name_td:
             continue
-        name = name_td.get_text(strip=True)
+        name = tag_text(name_td)
         value_td = name_td.find_next_sibling("td")
         if not value_td:
             continue
         if name == "КЭС:":
-            kes_items = [div.get_text(" ", strip=True) for div in value_td.find_all("div")]
+            kes_items = [tag_text(div, " ") for div in value_td.find_all("div")]
             if not kes_items:
-                text = value_td.get_text(" ", strip=True)
+                text = tag_text(value_td, " ")
                 if text:
                     kes_items = [text]
             meta["КЭС"] = kes_items
         elif name == "Тип ответа:":
-            meta["Тип ответа"] = value_td.get_text(" ", strip=True)
+            meta["Тип ответа"] = tag_text(value_td, " ")
     return meta
 
 
@@ -211,91 +260,91 @@ def parse_fipi_page(html: str, page_index: int) -> list[TaskDict]:
     soup = BeautifulSoup(html, "html.parser")
     tasks: list[TaskDict] = []
 
-    qblocks = soup.select("div.qblock")
+    # Блоки заданий и блоки с метаданными (`div#i<suffix>`) собираем одним проходом по div:
+    # поиск по всему документу на каждый qblock был главным расходом CPU на странице.
+    info_divs: dict[str, Tag] = {}
+    qblocks: list[Tag] = []
+    for div in soup.find_all("div"):
+        div_id = div.get("id")
+        if div_id is not None:
+            info_divs.setdefault(attr_to_str(div_id), div)
+        if has_class(div, "qblock"):
+            qblocks.append(div)
+
     for idx, qblock in enumerate(qblocks):
         qid = attr_to_str(qblock.get("id"))
         suffix = qid[1:] if qid else ""
-        info_div = soup.find("div", id=f"i{suffix}") if suffix else None
+        info_div = info_divs.get(f"i{suffix}") if suffix else None
 
-        cell = qblock.select_one("td.cell_0")
+        # Один обход qblock и один обход ячейки вопроса вместо отдельного find на каждый тег.
+        qblock_tags = group_tags(qblock, QBLOCK_TAG_NAMES)
+        cell = next((td for td in qblock_tags["td"] if has_class(td, "cell_0")), None)
         if cell is None:
             print(
                 f"Пропускаю блок без текста вопроса на странице {page_index} "
                 f"(qid={qid or 'нет'})"
             )
             continue
-        question_text = cell.get_text(" ", strip=True) if cell else ""
-        question_html = str(cell) if cell else ""
-
-        images: list[dict[str, str]] = []
+        question_text = cell.get_text(" ", strip=True)
+        question_html = str(cell)
+
+        cell_tags = group_tags(cell, CELL_TAG_NAMES)
+        images: list[dict[str, str]] = [
+            {"src": attr_to_str(img.get("src")), "alt": attr_to_str(img.get("alt"))}
+            for img in cell_tags["img"]
+        ]
         attachments: list[AttachmentDict] = []
-        if cell:
-            for img in cell.find_all("img"):
-                images.append(
-                    {"src": attr_to_str(img.get("src")), "alt": attr_to_str(img.get("alt"))}
-                )
-            script_images, script_attachments = extract_media_from_scripts(cell)
-            images.extend(script_images)
-            attachments.extend(script_attachments)
-            for att in extract_attachments(cell):
-                attachments.append({"href": att.href, "text": att.text})
-
-        guid_input = qblock.find("input", attrs={"name": "guid"})
+        script_images, script_attachments = extract_media_from_scripts(cell_tags["script"])
+        images.extend(script_images)
+        attachments.extend(script_attachments)
+        for att in extract_attachments(cell_tags["a"]):
+            attachments.append({"href": att.href, "text": att.text})
+
+        inputs = qblock_tags["input"]
+        guid_input = next((inp for inp in inputs if inp.get("name") == "guid"), None)
         guid = attr_to_str(guid_input.get("value")) if guid_input else ""
 
         options: list[OptionDict] = []
         answer_type = "unknown"
-        distractor_table = qblock.find("table", class_="distractors-table")
+        distractor_table = next(
+            (t for t in qblock_tags["table"] if has_class(t, "distractors-table")), None
+        )
         if distractor_table:
             answer_type, opts = extract_options(distractor_table)
             options = opts or []
         else:
-            answer_input = qblock.find("input", attrs={"name": "answer"})
+            answer_input = next((inp for inp in inputs if inp.get("name") == "answer"), None)
             answer_type_attr = attr_to_str(answer_input.get("type")) if answer_input else ""
-            text_inputs = [
-                inp
-                for inp in qblock.find_all("input")
-                if attr_to_str(inp.get("type")).lower() == "text"
-            ]
+            text_inputs = [inp for inp in inputs if attr_to_str(inp.get("type")).lower() == "text"]
             if answer_input and answer_type_attr.lower() == "text":
                 answer_type = "short_answer"
             elif text_inputs:
                 answer_type = "short_answer"
-            elif qblock.find("textarea"):
+            elif qblock_tags["textarea"]:
                 answer_type = "short_answer"
-            elif qblock.find("select"):
+            elif qblock_tags["select"]:
                 answer_type = "single_choice"
             elif answer_input:
                 answer_type = "unknown"
 
         hint = ""
-        hint_div = qblock.find("div", class_="hint")
+        hint_div = next((div for div in qblock_tags["div"] if has_class(div, "hint")), None)
         if hint_div:
-            hint_text = hint_div.get_text(" ", strip=True)
+            hint_text = tag_text(hint_div, " ")
             # Типовые подсказки («Впишите правильный ответ.» и т.п.) считаем дефолтными и опускаем,
             # чтобы не плодить шум. Любые другие тексты сохраняем.
-            default_hints = {
-                "Впишите правильный ответ.",
-                "Дайте развернутый ответ.",
-                "Дайте развёрнутый ответ.",
-                "Выберите правильный ответ.",
-            }
-            if hint_text not in default_hints:
+            if hint_text not in DEFAULT_HINTS:
                 hint = hint_text
 
-        internal_id_span = info_div.select_one("div.id-text span.canselect") if info_div else None
-        internal_id = internal_id_span.get_text(strip=True) if internal_id_span else suffix
+        internal_id_span = find_internal_id_span(info_div) if info_div else None
+        internal_id = tag_text(internal_id_span) if internal_id_span else suffix
 
         meta = parse_meta_block(info_div, suffix)
 
         if answer_type == "unknown":
             hint_lower = hint.lower()
-            raw_classes: list[str] | str | None = qblock.get("class")
-            qblock_classes = (
-                raw_classes if isinstance(raw_classes, list) else [attr_to_str(raw_classes)]
-            )
             if (
-                "hide-form" in qblock_classes
+                has_class(qblock, "hide-form")
                 or "развернут" in hint_lower
                 or "развёрнут" in hint_lower
             ):
@@ -324,13 +373,6 @@ def parse_fipi_page(html: str, page_index: int) -> list[TaskDict]:
     return tasks
 
 
-def normalize_url(url: str) -> str | None:
-    url = url.strip()
-    if not url or url.startswith("data:"):
-        return None
-    return urljoin(BASE_CONTEXT_URL, url)
-
-
 def choose_extension(url: str) -> str:
     parsed = urlsplit(url)
     ext = Path(parsed.path).suffix
@@ -338,31 +380,25 @@ def choose_extension(url: str) -> str:
 
 
 def build_asset_candidates(tasks: list[TaskDict]) -> list[AssetCandidate]:
-    candidates: list[AssetCandidate] = []
-    seen: set[tuple[str, str]] = set()
+    # dict сохраняет порядок вставки, так что он же служит и дедупликацией (первый побеждает).
+    unique: dict[tuple[str, str], AssetCandidate] = {}
     for task in tasks:
-        internal_id = str(task.get("internal_id", "")).strip()
-        for img in task.get("images", []):
-            src = str(img.get("src", "")).strip()
-            if not src:
-                continue
-            key = (internal_id, src)
-            if key in seen:
-                continue
-            seen.add(key)
-            candidates.append(AssetCandidate(internal_id=internal_id, source=src, kind="image"))
-        for att in task.get("attachments", []):
-            href = str(att.get("href", "")).strip()
-            if not href:
-                continue
-            key = (internal_id, href)
-            if key in seen:
-                continue
-            seen.add(key)
-            candidates.append(
-                AssetCandidate(internal_id=internal_id, source=href, kind="attachment")
-            )
-    return candidates
+        internal_id = task["internal_id"].strip()
+        for img in task["images"]:
+            src = img["src"].strip()
+            if src:
+                unique.setdefault(
+                    (internal_id, src),
+                    AssetCandidate(internal_id=internal_id, source=src, kind="image"),
+                )
+        for att in task["attachments"]:
+            href = att["href"].strip()
+            if href:
+                unique.setdefault(
+                    (internal_id, href),
+                    AssetCandidate(internal_id=internal_id, source=href, kind="attachment"),
+                )
+    return list(unique.values())
 
 
 def build_asset_mapping(
@@ -401,38 +437,30 @@ def build_asset_mapping(
 def rewrite_tasks(
     tasks: list[TaskDict], mapping_by_key: dict[tuple[str, str], AssetMapping]
 ) -> list[TaskDict]:
-    updated: list[TaskDict] = []
+    replacements_by_iid: defaultdict[str, dict[str, str]] = defaultdict(dict)
+    for (iid, source), mapping in mapping_by_key.items():
+        replacements_by_iid[iid][source] = mapping.short_name
+
+    # Задачи правим на месте: после переписывания исходный список никому не нужен,
+    # а задачи без файлов не трогаем вовсе.
     for task in tasks:
-        internal_id = str(task.get("internal_id", "")).strip()
-        replacements: dict[str, str] = {
-            source: mapping.short_name
-            for (iid, source), mapping in mapping_by_key.items()
-            if iid == internal_id
-        }
+        replacements = replacements_by_iid.get(task["internal_id"].strip())
+        if not replacements:
+            continue
 
-        new_task = dict(task)
-        new_images: list[dict[str, str]] = []
-        for img in task.get("images", []):
-            src = str(img.get("src", ""))
-            new_src = replacements.get(src, src)
-            new_images.append({"src": new_src, "alt": str(img.get("alt", ""))})
-        new_task["images"] = new_images
+        for img in task["images"]:
+            new_src = replacements.get(img["src"])
+            if new_src is not None:
+                img["src"] = new_src
 
-        new_attachments: list[dict[str, str]] = []
-        for att in task.get("attachments", []):
-            href = str(att.get("href", ""))
-            new_href = replacements.get(href, href)
-            new_attachments.append({"href": new_href, "text": str(att.get("text", ""))})
-        new_task["attachments"] = new_attachments
+        for att in task["attachments"]:
+            new_href = replacements.get(att["href"])
+            if new_href is not None:
+                att["href"] = new_href
 
-        question_html = str(task.get("question_html", ""))
-        for source, short_name in replacements.items():
-            if source in question_html:
-                question_html = question_html.replace(source, short_name)
-        new_task["question_html"] = question_html
+        task["question_html"] = replace_sources(task["question_html"], replacements)
 
-        updated.append(new_task)  # type: ignore[arg-type]
-    return updated
+    return tasks
 
 
 def write_map(entries: list[AssetMapping], map_path: Path) -> None:
@@ -449,80 +477,61 @@ def write_map(entries: list[AssetMapping], map_path: Path) -> None:
 
 
 def write_jsonl(tasks: Iterable[TaskDict], output_path: Path) -> None:
+    encode = JSONL_ENCODER.encode
+    lines = (encode(task) + "\n" for task in tasks)
     with output_path.open("w", encoding="utf-8") as f:
-        for task in tasks:
-            json_line = json.dumps(task, ensure_ascii=False)
-            f.write(json_line + "\n")
-
-
-def download_assets(
-    entries: list[AssetMapping],
-    max_files: int | None = None,
-    filter_substr: str | None = None,
-) -> None:
-    session = requests.Session()
-    session.headers.update({"User-Agent": USER_AGENT})
-    session.verify = not SKIP_SSL_VERIFY
-    if SKIP_SSL_VERIFY:
-        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)  # type: ignore[attr-defined]
-
-    downloaded = 0
-    for entry in entries:
-        if filter_substr and filter_substr not in entry.source_url:
-            continue
-        if max_files is not None and downloaded >= max_files:
-            print(f"Достигнут лимит {max_files} файлов, останавливаюсь.")
-            break
-
-        target = entry.saved_path
-        if target.exists():
-            continue
-        url = normalize_url(entry.source_url)
-        if not url:
-            print(f"Пропускаю некорректную ссылку: {entry.source_url}")
-            continue
-        target.parent.mkdir(parents=True, exist_ok=True)
-        urls_to_try = [url]
-        if "/bank/" in url:
-            urls_to_try.append(url.replace("/bank/", "/"))
-
-        content: bytes | None = None
-        last_status: int | None = None
-        for candidate in urls_to_try:
-            try:
-                resp = session.get(candidate, timeout=30)
-            except requests.RequestException as exc:
-                print(f"Ошибка загрузки {candidate}: {exc}")
-                continue
-            last_status = resp.status_code
-            if resp.status_code == 200:
-                content = resp.content
-                url = candidate
-                break
-        if content is None:
-            status_info = f"статус {last_status}" if last_status is not None else "нет ответа"
-            print(f"Не удалось скачать {url} ({status_info})")
-            continue
-        target.write_bytes(content)
-        downloaded += 1
-        print(f"Сохранено {target} из {url} ({len(content)} байт)")
+        # Пишем пачками строк: один write на пачку вместо вызова на каждую задачу.
+        while chunk := "".join(islice(lines, JSONL_WRITE_BATCH)):
+            f.write(chunk)
 
 
-def load_html_files(pages_dir: str) -> list[tuple[int, str]]:
+def list_html_files(pages_dir: str) -> list[tuple[int, Path]]:
     dir_path = Path(pages_dir)
     files: list[tuple[int, Path]] = []
     for path in dir_path.glob("*.html"):
-        match = re.search(r"page_(\d+)\.html", path.name)
+        match = PAGE_FILE_RE.search(path.name)
         page_idx = int(match.group(1)) if match else -1
         files.append((page_idx, path))
     files.sort(key=lambda item: (item[0], item[1].name))
+    return files
 
-    result: list[tuple[int, str]] = []
-    for page_idx, path in files:
-        data = path.read_bytes()
-        html = decode_html_bytes(data)
-        result.append((page_idx, html))
-    return result
+
+def read_files(paths: list[Path]) -> Iterator[bytes]:
+    """Читает файлы пулом потоков (read отпускает GIL), отдавая содержимое по порядку."""
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        yield from executor.map(Path.read_bytes, paths)
+
+
+def parse_page_file(page_idx: int, path: Path) -> tuple[list[TaskDict], str]:
+    """Читает и разбирает одну страницу в процессе-воркере.
+
+    Вывод парсера возвращается строкой, чтобы лог печатался в порядке страниц.
+    """
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        tasks = parse_fipi_page(decode_html_bytes(path.read_bytes()), page_idx)
+    return tasks, buffer.getvalue()
+
+
+def parse_pages(
+    files: list[tuple[int, Path]], workers: int
+) -> Iterator[tuple[int, list[TaskDict]]]:
+    """Разбирает страницы (по возможности параллельно), сохраняя порядок файлов."""
+    if workers <= 1 or len(files) < 2:
+        # Следующие страницы читаются с диска, пока разбирается текущая.
+        blobs = read_files([path for _, path in files])
+        for (page_idx, _), data in zip(files, blobs, strict=True):
+            yield page_idx, parse_fipi_page(decode_html_bytes(data), page_idx)
+        return
+
+    page_indices = [page_idx for page_idx, _ in files]
+    paths = [path for _, path in files]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(parse_page_file, page_indices, paths)
+        for page_idx, (tasks, log) in zip(page_indices, results, strict=True):
+            if log:
+                print(log, end="")
+            yield page_idx, tasks
 
 
 def load_internal_id_to_task_number(path: Path) -> dict[str, int | None]:
@@ -550,24 +559,16 @@ def drop_images_for_internal_ids(
 ) -> int:
     removed = 0
     for task in tasks:
-        iid = str(task.get("internal_id", "")).strip().lower()
-        if iid not in internal_ids:
+        if task["internal_id"].strip().lower() not in internal_ids:
             continue
-        images = task.get("images", [])
-        kept: list[dict[str, str]] = []
-        for img in images:
-            src = str(img.get("src", ""))
-            if url_extension(src) in drop_exts:
-                removed += 1
-                continue
-            kept.append({"src": src, "alt": str(img.get("alt", ""))})
+        images = task["images"]
+        kept = [img for img in images if url_extension(img["src"]) not in drop_exts]
+        removed += len(images) - len(kept)
         task["images"] = kept
     return removed
 
 
-def main() -> None:
-    import argparse
-
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Парсинг страниц FIPI с генерацией коротких путей и скачиванием файлов"
     )
@@ -635,17 +636,32 @@ def main() -> None:
         default=[".png", ".gif"],
         help="Расширения картинок для удаления (можно повторять), по умолчанию: .png и .gif",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Число процессов для разбора страниц",
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=DOWNLOAD_WORKERS,
+        help="Число параллельных загрузок файлов",
+    )
+    return parser.parse_args(argv)
 
+
+def collect_tasks(args: argparse.Namespace) -> list[TaskDict]:
+    """Всё, кроме записи tasks.jsonl: разбор страниц, map.json, загрузка и переписывание путей."""
     all_tasks: list[TaskDict] = []
-    for page_idx, html in load_html_files(str(args.pages_dir)):
-        page_tasks = parse_fipi_page(html, page_idx)
+    files = list_html_files(str(args.pages_dir))
+    for page_idx, page_tasks in parse_pages(files, args.workers):
         all_tasks.extend(page_tasks)
         print(f"Страница {page_idx}: найдено задач {len(page_tasks)}")
 
     if not all_tasks:
         print("Не найдено задач, ничего не делаю.")
-        return
+        return []
 
     if args.drop_images_for_task_number:
         mapping = load_internal_id_to_task_number(args.internal_id_to_task_number)
@@ -667,11 +683,23 @@ def main() -> None:
     print(f"Сохранён мэппинг: {args.map} ({len(entries)} элементов)")
 
     if not args.no_download:
-        download_assets(entries, max_files=args.max_files, filter_substr=args.filter_substr)
+        download_entries(
+            entries,
+            max_files=args.max_files,
+            filter_substr=args.filter_substr,
+            workers=max(1, args.download_workers),
+        )
+
+    return rewrite_tasks(all_tasks, mapping_by_key)
 
-    rewritten_tasks = rewrite_tasks(all_tasks, mapping_by_key)
-    write_jsonl(rewritten_tasks, args.output)
-    print(f"Всего записано задач: {len(rewritten_tasks)}")
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    tasks = collect_tasks(args)
+    if not tasks:
+        return
+    write_jsonl(tasks, args.output)
+    print(f"Всего записано задач: {len(tasks)}")
 
 
 if __name__ == "__main__":
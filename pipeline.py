@@ -1,18 +1,44 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
+import io
 import json
+import os
 import shlex
 import shutil
 import subprocess
 import sys
+import tarfile
+import threading
 import time
+from collections.abc import Collection
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from graphlib import TopologicalSorter
 from pathlib import Path
-from typing import Any
+from typing import Any, TextIO
 
 import yaml
 
-from generate_task_mdx import load_task_number_map, render_task_mdx
+import parse_fipi_pages
+import transform_tasks
+from generate_task_mdx import (
+    load_internal_ids_by_task_number,
+    load_offset_index,
+    load_task_number_map,
+    write_task_mdx,
+    write_tasks_mdx,
+)
+from scripts import verify_mdx
+
+RENDER_CACHE_NAME = ".render_cache.json"
+RENDER_SOURCES = ("generate_task_mdx.py", "transform_tasks.py")
+PUBLISH_WORKERS = 16
+STAGE_WORKERS = 4
+# Стадии, которые сами поднимают ProcessPoolExecutor (в fused-режиме — ещё parse и transform).
+PROCESS_POOL_STAGES = frozenset({"render_mdx"})
+FUSED_STAGES = frozenset({"parse_pages", "transform_tasks"})
 
 
 def parse_args() -> argparse.Namespace:
@@ -30,6 +56,12 @@ def parse_args() -> argparse.Namespace:
         default="",
         help="Пропустить перечисленные стадии (через запятую).",
     )
+    parser.add_argument(
+        "--stage-workers",
+        type=int,
+        default=STAGE_WORKERS,
+        help="Сколько независимых стадий (см. depends_on) запускать одновременно.",
+    )
     return parser.parse_args()
 
 
@@ -64,10 +96,43 @@ def resolve_paths(cfg: dict[str, Any], root: Path) -> dict[str, Path]:
     return paths
 
 
-def run_cmd(cmd: list[str]) -> None:
+def run_cmd(cmd: list[str], *, capture: bool = False) -> None:
     pretty = " ".join(shlex.quote(part) for part in cmd)
     print(f"$ {pretty}")
-    subprocess.run(cmd, check=True)
+    if not capture:
+        subprocess.run(cmd, check=True)
+        return
+    # Стадия идёт в фоне: вывод процесса забираем, чтобы он попал в её буфер.
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    print(result.stdout, end="")
+    result.check_returncode()
+
+
+def print_in_process(cmd: list[str]) -> None:
+    pretty = " ".join(shlex.quote(part) for part in cmd[1:])
+    print(f"$ [fused] {pretty}")
+
+
+@dataclass(slots=True)
+class FusedHandoff:
+    """Режим `fused: true`: parse и transform идут в этом процессе.
+
+    Задачи parse передаются в transform в памяти (transform не читает и не разбирает
+    tasks.jsonl), если его выход — вход одной из выбранных transform-стадий. Сам tasks.jsonl
+    parse по-прежнему записывает.
+    """
+
+    consumed: set[Path]
+    rows: dict[Path, list[Any]] = field(default_factory=dict)
+
+    @classmethod
+    def for_stages(cls, stages: list[dict[str, Any]], paths: dict[str, Path]) -> FusedHandoff:
+        consumed = {
+            Path(resolve_refs(stage.get("params") or {}, paths)["input"])
+            for stage in stages
+            if stage.get("type") == "transform_tasks"
+        }
+        return cls(consumed=consumed)
 
 
 def stage_enabled(stage: dict[str, Any], only: set[str], skip: set[str]) -> bool:
@@ -113,19 +178,45 @@ def build_transform_cmd(params: dict[str, Any]) -> list[str]:
     return cmd
 
 
+def render_code_digest() -> str:
+    """Хэш исходников рендера: правка кода должна сбрасывать кэш MDX."""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in RENDER_SOURCES:
+        digest.update(Path(__file__).with_name(name).read_bytes())
+    return digest.hexdigest()
+
+
+def load_render_cache(path: Path, stamp: str) -> dict[str, list[Any]]:
+    """INTERNAL_ID -> [хэш строки jsonl, size MDX, mtime_ns MDX] с прошлого запуска."""
+    try:
+        cached = json.loads(path.read_bytes())
+        if cached.get("stamp") == stamp:
+            return cached["rows"]
+    except (OSError, ValueError, AttributeError, KeyError):
+        pass
+    return {}
+
+
 def render_mdx_all(params: dict[str, Any]) -> dict[str, int]:
     input_path = Path(params["input"])
     output_dir = Path(params["output_dir"])
     output_dir.mkdir(parents=True, exist_ok=True)
     overwrite = bool(params.get("overwrite", False))
+    use_cache = overwrite and bool(params.get("cache", True))
+    workers = int(params.get("workers") or os.cpu_count() or 1)
     task_number_map_path = Path(params.get("task_number_map") or "internal_id_to_task_number.json")
     task_number_map = load_task_number_map(task_number_map_path)
 
     written = 0
     skipped = 0
+    unchanged = 0
     total = 0
+    # Сначала собираем задания, потом рендерим пачкой: при повторе internal_id
+    # с overwrite побеждает последняя строка, без overwrite — первая.
+    jobs: dict[str, tuple[dict[str, Any], int | None, Path]] = {}
+    row_digests: dict[str, str] = {}
 
-    with input_path.open(encoding="utf-8") as f:
+    with input_path.open("rb") as f:
         for line in f:
             line = line.strip()
             if not line:
@@ -136,14 +227,95 @@ def render_mdx_all(params: dict[str, Any]) -> dict[str, int]:
             if not internal_id:
                 continue
             out_path = output_dir / f"{internal_id}.mdx"
-            if out_path.exists() and not overwrite:
+            if not overwrite and (internal_id in jobs or out_path.exists()):
                 skipped += 1
                 continue
             task_number = task_number_map.get(internal_id)
-            out_path.write_text(render_task_mdx(row, task_number=task_number), encoding="utf-8")
+            jobs[internal_id] = (row, task_number, out_path)
             written += 1
-
-    return {"total": total, "written": written, "skipped": skipped}
+            if use_cache:
+                digest = hashlib.blake2b(line, digest_size=16)
+                digest.update(str(task_number).encode("ascii"))
+                row_digests[internal_id] = digest.hexdigest()
+
+    if not use_cache:
+        unchanged = len(jobs) - write_tasks_mdx(list(jobs.values()), workers=workers)
+        written -= unchanged
+        return {"total": total, "written": written, "skipped": skipped, "unchanged": unchanged}
+
+    # Строка jsonl, номер задачи и код рендера те же, а MDX не трогали руками
+    # (size и mtime совпадают) — рендерить и перезаписывать файл незачем.
+    # Кэш лежит в каталоге сборки, а не рядом с MDX: frontend/content/tasks правят руками.
+    # Каталог MDX входит в штамп, чтобы стадии с разным output_dir не путали записи.
+    cache_path = Path(params.get("cache_dir") or "build") / RENDER_CACHE_NAME
+    stamp = f"{render_code_digest()}:{output_dir.resolve()}"
+    cache = load_render_cache(cache_path, stamp)
+    for internal_id, row_digest in row_digests.items():
+        entry = cache.get(internal_id)
+        if not entry or entry[0] != row_digest:
+            continue
+        try:
+            st = jobs[internal_id][2].stat()
+        except FileNotFoundError:
+            continue
+        if [st.st_size, st.st_mtime_ns] == entry[1:]:
+            del jobs[internal_id]
+            written -= 1
+            unchanged += 1
+
+    identical = len(jobs) - write_tasks_mdx(list(jobs.values()), workers=workers)
+    written -= identical
+    unchanged += identical
+
+    rows: dict[str, list[Any]] = {}
+    for internal_id, row_digest in row_digests.items():
+        if internal_id in jobs:
+            st = jobs[internal_id][2].stat()
+            rows[internal_id] = [row_digest, st.st_size, st.st_mtime_ns]
+        else:
+            rows[internal_id] = cache[internal_id]
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    cache_path.write_text(json.dumps({"stamp": stamp, "rows": rows}), encoding="utf-8")
+
+    return {"total": total, "written": written, "skipped": skipped, "unchanged": unchanged}
+
+
+def read_indexed_rows(
+    input_path: Path, offsets: dict[str, list[int]], ids: Collection[str]
+) -> list[dict[str, Any]] | None:
+    """Строки `ids` по индексу смещений; None, если строка по смещению — чужая."""
+    rows: list[dict[str, Any]] = []
+    wanted = sorted((offset, i) for i in ids for offset in offsets.get(i, ()))
+    with input_path.open("rb") as f:
+        for offset, internal_id in wanted:
+            f.seek(offset)
+            row = json.loads(f.readline())
+            if str(row.get("internal_id") or "").strip().upper() != internal_id:
+                return None
+            rows.append(row)
+    return rows
+
+
+def read_rows_by_ids(input_path: Path, ids: Collection[str]) -> list[dict[str, Any]]:
+    """Все строки jsonl с INTERNAL_ID (UPPER) из `ids` в порядке файла.
+
+    Читаем только нужные строки по индексу смещений. Если индекс не сошёлся со строкой,
+    пересобираем его, а если не помогло и это — линейным проходом по всему файлу.
+    """
+    for rebuild in (False, True):
+        rows = read_indexed_rows(input_path, load_offset_index(input_path, rebuild=rebuild), ids)
+        if rows is not None:
+            return rows
+    rows = []
+    with input_path.open("rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            if str(row.get("internal_id") or "").strip().upper() in ids:
+                rows.append(row)
+    return rows
 
 
 def render_mdx_task_number(params: dict[str, Any]) -> dict[str, int]:
@@ -152,36 +324,53 @@ def render_mdx_task_number(params: dict[str, Any]) -> dict[str, int]:
     output_dir.mkdir(parents=True, exist_ok=True)
     overwrite = bool(params.get("overwrite", False))
     task_number = int(params["task_number"])
+    workers = int(params.get("workers") or os.cpu_count() or 1)
 
     task_number_map_path = Path(params.get("task_number_map") or "internal_id_to_task_number.json")
-    task_number_map = load_task_number_map(task_number_map_path)
-    target_ids = {k for k, v in task_number_map.items() if v == task_number}
+    target_ids = load_internal_ids_by_task_number(task_number_map_path).get(
+        task_number, frozenset()
+    )
 
     written = 0
     skipped = 0
     total = 0
-
-    with input_path.open(encoding="utf-8") as f:
+    jobs: dict[str, tuple[dict[str, Any], int | None, Path]] = {}
+
+    # Строки в порядке файла, как при полном проходе: с overwrite побеждает последняя
+    # строка internal_id, без overwrite — первая.
+    for row in read_rows_by_ids(input_path, target_ids):
+        internal_id = str(row.get("internal_id") or "").strip().upper()
+        total += 1
+        out_path = output_dir / f"{internal_id}.mdx"
+        if not overwrite and (internal_id in jobs or out_path.exists()):
+            skipped += 1
+            continue
+        jobs[internal_id] = (row, task_number, out_path)
+        written += 1
+
+    unchanged = len(jobs) - write_tasks_mdx(list(jobs.values()), workers=workers)
+    written -= unchanged
+    return {"total": total, "written": written, "skipped": skipped, "unchanged": unchanged}
+
+
+def find_row(input_path: Path, internal_id: str) -> dict[str, Any] | None:
+    """Первая строка jsonl с данным INTERNAL_ID (UPPER): по индексу, иначе линейным проходом."""
+    offsets = load_offset_index(input_path).get(internal_id)
+    with input_path.open("rb") as f:
+        if offsets:
+            f.seek(offsets[0])
+            row = json.loads(f.readline())
+            if str(row.get("internal_id") or "").strip().upper() == internal_id:
+                return row
+            f.seek(0)
         for line in f:
             line = line.strip()
             if not line:
                 continue
             row = json.loads(line)
-            internal_id = str(row.get("internal_id") or "").strip().upper()
-            if not internal_id or internal_id not in target_ids:
-                continue
-            total += 1
-            out_path = output_dir / f"{internal_id}.mdx"
-            if out_path.exists() and not overwrite:
-                skipped += 1
-                continue
-            out_path.write_text(
-                render_task_mdx(row, task_number=task_number),
-                encoding="utf-8",
-            )
-            written += 1
-
-    return {"total": total, "written": written, "skipped": skipped}
+            if str(row.get("internal_id") or "").strip().upper() == internal_id:
+                return row
+    return None
 
 
 def render_mdx_internal_id(params: dict[str, Any]) -> dict[str, int]:
@@ -191,75 +380,131 @@ def render_mdx_internal_id(params: dict[str, Any]) -> dict[str, int]:
     overwrite = bool(params.get("overwrite", False))
     internal_id = str(params["internal_id"]).strip().upper()
 
-    written = 0
-    skipped = 0
-    total = 0
-
-    with input_path.open(encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
+    row = find_row(input_path, internal_id)
+    if row is None:
+        return {"total": 0, "written": 0, "skipped": 0, "unchanged": 0}
+
+    out_path = output_dir / f"{internal_id}.mdx"
+    if out_path.exists() and not overwrite:
+        return {"total": 1, "written": 0, "skipped": 1, "unchanged": 0}
+    if not write_task_mdx(row, None, out_path):
+        return {"total": 1, "written": 0, "skipped": 0, "unchanged": 1}
+    return {"total": 1, "written": 1, "skipped": 0, "unchanged": 0}
+
+
+def bundle_into_tar(src: Path, dst: Path) -> tuple[int, int]:
+    """Пакует src в один `<dst>.tar` (внутри — `<dst.name>/...`); возвращает (файлов, папок).
+
+    Один последовательный файл вместо тысяч мелких — дешевле на сетевых/медленных дисках.
+    """
+    tar_path = dst.with_name(dst.name + ".tar")
+    tar_path.parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(tar_path, "w") as tar:
+        tar.add(src, arcname=dst.name)
+        members = tar.getmembers()
+    files = sum(1 for m in members if m.isfile())
+    dirs = sum(1 for m in members if m.isdir() and m.name != dst.name)
+    print(f"Архив: {tar_path} (файлов {files}, папок {dirs})")
+    return files, dirs
+
+
+def publish_assets(
+    copy_specs: list[dict[str, Any]],
+    *,
+    workers: int = PUBLISH_WORKERS,
+) -> dict[str, int]:
+    copied_files = 0
+    copied_dirs = 0
+    # Копирование упирается в I/O (GIL отпускается), поэтому файлы копируем в пуле потоков.
+    futures: list[Future[Any]] = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for spec in copy_specs:
+            src = Path(spec["from"]).resolve()
+            dst = Path(spec["to"]).resolve()
+            if spec.get("bundle"):
+                if not src.exists():
+                    raise FileNotFoundError(f"Источник для publish не найден: {src}")
+                files, dirs = bundle_into_tar(src, dst)
+                copied_files += files
+                copied_dirs += dirs
                 continue
-            row = json.loads(line)
-            row_id = str(row.get("internal_id") or "").strip().upper()
-            if row_id != internal_id:
+            if src.is_dir():
+                # Все цели лежат прямо в dst: создаём его один раз, а пути собираем строками.
+                dst.mkdir(parents=True, exist_ok=True)
+                dst_str = str(dst)
+                with os.scandir(src) as it:
+                    for entry in it:
+                        target = os.path.join(dst_str, entry.name)
+                        if entry.is_dir():
+                            futures.append(
+                                pool.submit(
+                                    shutil.copytree,
+                                    entry.path,
+                                    target,
+                                    copy_function=shutil.copyfile,
+                                    dirs_exist_ok=True,
+                                )
+                            )
+                            copied_dirs += 1
+                        else:
+                            futures.append(pool.submit(shutil.copyfile, entry.path, target))
+                            copied_files += 1
                 continue
-            total += 1
-            out_path = output_dir / f"{internal_id}.mdx"
-            if out_path.exists() and not overwrite:
-                skipped += 1
-                return {"total": total, "written": written, "skipped": skipped}
-            out_path.write_text(
-                render_task_mdx(row, task_number=None),
-                encoding="utf-8",
-            )
-            written += 1
-            return {"total": total, "written": written, "skipped": skipped}
-
-    return {"total": total, "written": written, "skipped": skipped}
-
 
-def publish_assets(copy_specs: list[dict[str, Any]]) -> dict[str, int]:
-    copied_files = 0
-    copied_dirs = 0
-    for spec in copy_specs:
-        src = Path(spec["from"]).resolve()
-        dst = Path(spec["to"]).resolve()
-        if src.is_dir():
-            dst.mkdir(parents=True, exist_ok=True)
-            for item in src.iterdir():
-                target = dst / item.name
-                if item.is_dir():
-                    shutil.copytree(item, target, dirs_exist_ok=True)
-                    copied_dirs += 1
-                else:
-                    target.parent.mkdir(parents=True, exist_ok=True)
-                    target.write_bytes(item.read_bytes())
-                    copied_files += 1
-            continue
+            if src.is_file():
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                futures.append(pool.submit(shutil.copyfile, src, dst))
+                copied_files += 1
+                continue
 
-        if src.is_file():
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            dst.write_bytes(src.read_bytes())
-            copied_files += 1
-            continue
+            raise FileNotFoundError(f"Источник для publish не найден: {src}")
 
-        raise FileNotFoundError(f"Источник для publish не найден: {src}")
+        for future in futures:
+            future.result()
 
     return {"files": copied_files, "dirs": copied_dirs}
 
 
-def run_stage(stage: dict[str, Any], paths: dict[str, Path]) -> dict[str, Any]:
+def run_stage(
+    stage: dict[str, Any],
+    paths: dict[str, Path],
+    fused: FusedHandoff | None = None,
+    *,
+    capture: bool = False,
+) -> dict[str, Any]:
     stage_type = stage.get("type")
     params = resolve_refs(stage.get("params") or {}, paths)
     started = time.time()
 
     if stage_type == "parse_pages":
-        run_cmd(build_parse_cmd(params))
+        cmd = build_parse_cmd(params)
+        if fused is None:
+            run_cmd(cmd, capture=capture)
+            return {"status": "ok", "duration": time.time() - started}
+        print_in_process(cmd)
+        output = Path(params["output"])
+        tasks = parse_fipi_pages.collect_tasks(parse_fipi_pages.parse_args(cmd[2:]))
+        if tasks:
+            # tasks.jsonl пишем и в fused-режиме, чтобы он не отставал от map.json
+            # и tasks_clean.jsonl; transform же берёт задачи из памяти, не перечитывая файл.
+            parse_fipi_pages.write_jsonl(tasks, output)
+            print(f"Всего записано задач: {len(tasks)}")
+            if output in fused.consumed:
+                fused.rows[output] = tasks
+                print(f"Задачи переданы в transform в памяти: {len(tasks)}")
         return {"status": "ok", "duration": time.time() - started}
 
     if stage_type == "transform_tasks":
-        run_cmd(build_transform_cmd(params))
+        cmd = build_transform_cmd(params)
+        if fused is None:
+            run_cmd(cmd, capture=capture)
+            return {"status": "ok", "duration": time.time() - started}
+        print_in_process(cmd)
+        rows = fused.rows.pop(Path(params["input"]), None)
+        if rows is None:
+            transform_tasks.main(cmd[2:])
+        else:
+            transform_tasks.transform_rows(rows, transform_tasks.parse_args(cmd[2:]))
         return {"status": "ok", "duration": time.time() - started}
 
     if stage_type == "render_mdx":
@@ -284,22 +529,172 @@ def run_stage(stage: dict[str, Any], paths: dict[str, Path]) -> dict[str, Any]:
                 continue
             resolved = resolve_refs(item, paths)
             resolved_specs.append(resolved)
-        stats = publish_assets(resolved_specs)
+        workers = int(params.get("workers") or PUBLISH_WORKERS)
+        stats = publish_assets(resolved_specs, workers=workers)
         return {"status": "ok", "duration": time.time() - started, "stats": stats}
 
     if stage_type == "verify_mdx":
-        script = Path(__file__).with_name("scripts").joinpath("verify_mdx.py")
-        cmd = [sys.executable, str(script)]
-        cmd += ["--input", str(params["input"])]
-        cmd += ["--mdx-dir", str(params["mdx_dir"])]
-        if params.get("allow_extra"):
-            cmd.append("--allow-extra")
-        run_cmd(cmd)
+        # В этом же процессе: без запуска отдельного интерпретатора ради одной проверки.
+        ok = verify_mdx.run(
+            Path(params["input"]),
+            Path(params["mdx_dir"]),
+            allow_extra=bool(params.get("allow_extra")),
+        )
+        if not ok:
+            raise RuntimeError("verify_mdx: MDX не соответствуют задачам (см. отчёт выше)")
         return {"status": "ok", "duration": time.time() - started}
 
     raise ValueError(f"Неизвестный тип стадии: {stage_type}")
 
 
+def stage_id(stage: dict[str, Any]) -> str:
+    return str(stage.get("id") or stage.get("type"))
+
+
+def stage_dependencies(stages: list[dict[str, Any]], selected: list[int]) -> dict[int, set[int]]:
+    """Граф выбранных стадий по индексам в `stages`: без `depends_on` стадия ждёт предыдущую.
+
+    Неизвестный id в `depends_on` — ошибка конфига. Зависимость от выключенной или
+    отфильтрованной (--only/--skip) стадии заменяется её собственными зависимостями,
+    чтобы порядок остальных стадий сохранялся.
+    """
+    index_by_id = {stage_id(stage): i for i, stage in enumerate(stages)}
+    direct: dict[int, set[int]] = {}
+    for i, stage in enumerate(stages):
+        depends_on = stage.get("depends_on")
+        if depends_on is None:
+            direct[i] = {i - 1} if i else set()
+            continue
+        if not isinstance(depends_on, list):
+            raise ValueError("depends_on должен быть списком")
+        unknown = [str(dep) for dep in depends_on if str(dep) not in index_by_id]
+        if unknown:
+            raise ValueError(f"Стадия {stage_id(stage)}: неизвестные depends_on: {unknown}")
+        direct[i] = {index_by_id[str(dep)] for dep in depends_on}
+
+    enabled = set(selected)
+    resolved: dict[int, set[int]] = {}
+
+    def resolve(i: int) -> set[int]:
+        if i not in resolved:
+            resolved[i] = set()
+            for dep in direct[i]:
+                resolved[i] |= {dep} if dep in enabled else resolve(dep)
+        return resolved[i]
+
+    return {i: resolve(i) for i in selected}
+
+
+def uses_process_pool(stage: dict[str, Any], fused: FusedHandoff | None) -> bool:
+    """Стадия поднимает ProcessPoolExecutor в этом процессе (fork при живых потоках опасен)."""
+    stage_type = stage.get("type")
+    if stage_type in PROCESS_POOL_STAGES:
+        return True
+    return fused is not None and stage_type in FUSED_STAGES
+
+
+class StageOutput:
+    """sys.stdout на время run_stages: стадия из пула потоков пишет в свой буфер.
+
+    Буфер печатается целиком, когда стадия закончилась, поэтому вывод параллельных стадий
+    не перемешивается. Вывод главного потока идёт в исходный stdout как есть.
+    """
+
+    def __init__(self, stream: TextIO) -> None:
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text: str) -> int:
+        buffer: io.StringIO | None = getattr(self.local, "buffer", None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self) -> None:
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
+    def run_buffered(
+        self,
+        stage: dict[str, Any],
+        paths: dict[str, Path],
+        fused: FusedHandoff | None,
+    ) -> tuple[dict[str, Any], str]:
+        """run_stage в потоке пула; возвращает итог стадии и её вывод."""
+        buffer = io.StringIO()
+        self.local.buffer = buffer
+        try:
+            return run_stage(stage, paths, fused, capture=True), buffer.getvalue()
+        except BaseException:
+            self.local.buffer = None
+            print(buffer.getvalue(), end="")
+            raise
+        finally:
+            self.local.buffer = None
+
+
+def run_stages(
+    stages: list[dict[str, Any]],
+    graph: dict[int, set[int]],
+    paths: dict[str, Path],
+    *,
+    workers: int,
+    fused: FusedHandoff | None = None,
+) -> list[dict[str, Any]]:
+    """Запускает стадии графа (индексы в `stages`) по зависимостям; независимые — параллельно.
+
+    Одиночная стадия идёт в главном потоке с обычным выводом. Стадии с пулом процессов
+    запускаются только в главном потоке и когда других потоков нет: fork процесса с живыми
+    потоками может зависнуть.
+    """
+    sorter = TopologicalSorter(graph)
+    sorter.prepare()
+    infos: dict[int, dict[str, Any]] = {}
+    ready: list[int] = []
+    running: dict[Future[tuple[dict[str, Any], str]], int] = {}
+    pool: ThreadPoolExecutor | None = None
+    output = StageOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        while sorter.is_active():
+            ready.extend(sorted(sorter.get_ready()))
+            exclusive = next((i for i in ready if uses_process_pool(stages[i], fused)), None)
+            if not running and (exclusive is not None or len(ready) == 1):
+                i = ready[0] if exclusive is None else exclusive
+                ready.remove(i)
+                if pool is not None:
+                    pool.shutdown()
+                    pool = None
+                print(f"\n==> {stage_id(stages[i])}")
+                infos[i] = run_stage(stages[i], paths, fused)
+                print(f"<== {stage_id(stages[i])}: {infos[i]['duration']:.1f} с")
+                sorter.done(i)
+                continue
+            # Если ждёт стадия с пулом процессов, новых фоновых не запускаем: она стартует,
+            # когда допишутся уже идущие.
+            if exclusive is None:
+                if pool is None:
+                    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+                for i in ready:
+                    print(f"\n==> {stage_id(stages[i])} (в фоне, вывод — по завершении)")
+                    running[pool.submit(output.run_buffered, stages[i], paths, fused)] = i
+                ready.clear()
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                infos[i], log = future.result()
+                print(f"\n--- {stage_id(stages[i])} ---")
+                print(log, end="")
+                print(f"<== {stage_id(stages[i])}: {infos[i]['duration']:.1f} с")
+                sorter.done(i)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        sys.stdout = output.stream
+    return [{"id": stage_id(stages[i]), **infos[i]} for i in sorted(infos)]
+
+
 def main() -> None:
     args = parse_args()
     cfg = load_config(args.config)
@@ -314,15 +709,13 @@ def main() -> None:
     if not isinstance(stages, list):
         raise ValueError("stages должен быть списком")
 
-    for stage in stages:
-        if not isinstance(stage, dict):
-            continue
-        if not stage_enabled(stage, only, skip):
-            continue
-        stage_id = str(stage.get("id") or stage.get("type"))
-        print(f"\n==> {stage_id}")
-        info = run_stage(stage, paths)
-        report["stages"].append({"id": stage_id, **info})
+    stages = [stage for stage in stages if isinstance(stage, dict)]
+    selected = [i for i, stage in enumerate(stages) if stage_enabled(stage, only, skip)]
+    graph = stage_dependencies(stages, selected)
+    fused = (
+        FusedHandoff.for_stages([stages[i] for i in selected], paths) if cfg.get("fused") else None
+    )
+    report["stages"] = run_stages(stages, graph, paths, workers=args.stage_workers, fused=fused)
 
     report_cfg = cfg.get("report") or {}
     report_path = resolve_refs(report_cfg.get("output") or "", paths)
@@ -2,16 +2,45 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
+import re
+from contextlib import nullcontext
+from functools import lru_cache
 from pathlib import Path
 from urllib.parse import urlsplit
 
+JSONL_ENCODER = json.JSONEncoder(ensure_ascii=False)
+WRITE_BUFFER_SIZE = 1 << 20
 
+
+# Непечатные/не-ASCII символы и скобки IPv6: urlsplit их вычищает или валидирует.
+URL_SLOW_PATH_RE = re.compile(r"[^\x20-\x7e]|[\[\]]")
+
+
+@lru_cache(maxsize=16384)
 def url_extension(url: str) -> str:
-    return Path(urlsplit(url.strip()).path).suffix.lower()
+    name = url_basename(url)
+    # То же правило, что у Path.suffix.
+    i = name.rfind(".")
+    return name[i:].lower() if 0 < i < len(name) - 1 else ""
 
 
+@lru_cache(maxsize=16384)
 def url_basename(url: str) -> str:
-    return Path(urlsplit(url.strip()).path).name
+    s = url.strip()
+    if not URL_SLOW_PATH_RE.search(s):
+        # Быстрый путь: последний сегмент пути без разбора всей грамматики URL.
+        path = s.partition("#")[0].partition("?")[0]
+        head, _, name = path.rpartition("/")
+        netloc_at = path.find("//")
+        if (
+            name
+            and name != "."
+            and (head or ":" not in name)
+            and (netloc_at < 0 or path.find("/", netloc_at + 2) >= 0)
+        ):
+            return name
+    return Path(urlsplit(s).path).name
 
 
 def load_internal_id_set(path: Path, task_numbers: set[int]) -> set[str]:
@@ -71,72 +100,88 @@ def main() -> None:
     tasks_matched = 0
     images_removed = 0
 
-    out_lines: list[str] = []
-    with args.tasks.open(encoding="utf-8") as f:
-        for line in f:
-            line = line.rstrip("\n")
-            if not line:
-                continue
-            tasks_seen += 1
-            row = json.loads(line)
-            iid = str(row.get("internal_id", "")).strip().lower()
-            if iid in internal_ids and isinstance(row.get("images"), list):
-                tasks_matched += 1
-                new_images: list[dict] = []
-                for item in row["images"]:
-                    if not isinstance(item, dict):
+    encode = JSONL_ENCODER.encode
+    # Строки сразу пишем во временный файл (только с --apply), а не копим в памяти;
+    # tasks.jsonl подменяется атомарно в конце.
+    tmp_path = args.tasks.with_name(args.tasks.name + ".tmp")
+    out_ctx = (
+        tmp_path.open("w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE)
+        if args.apply
+        else nullcontext()
+    )
+    # Если что-то упало до подмены tasks.jsonl, недописанный .tmp не оставляем.
+    try:
+        with args.tasks.open("rb") as f, out_ctx as out:
+            for line in f:
+                if not line.strip():
+                    continue
+                tasks_seen += 1
+                row = json.loads(line)
+                iid = str(row.get("internal_id", "")).strip().lower()
+                if iid in internal_ids and isinstance(row.get("images"), list):
+                    tasks_matched += 1
+                    new_images: list[dict] = []
+                    for item in row["images"]:
+                        if not isinstance(item, dict):
+                            new_images.append(item)
+                            continue
+                        src = str(item.get("src", ""))
+                        if url_extension(src) in drop_exts:
+                            images_removed += 1
+                            basename = url_basename(src)
+                            if basename:
+                                removed_files.add(basename)
+                            continue
                         new_images.append(item)
-                        continue
-                    src = str(item.get("src", ""))
-                    if url_extension(src) in drop_exts:
-                        images_removed += 1
-                        basename = url_basename(src)
-                        if basename:
-                            removed_files.add(basename)
-                        continue
-                    new_images.append(item)
-                row["images"] = new_images
-            out_lines.append(json.dumps(row, ensure_ascii=False))
-
-    map_removed = 0
-    if args.map.exists():
-        raw_map = json.loads(args.map.read_text(encoding="utf-8"))
-        if isinstance(raw_map, dict) and removed_files:
-            for fname in list(raw_map.keys()):
-                if fname in removed_files:
-                    raw_map.pop(fname, None)
-                    map_removed += 1
+                    row["images"] = new_images
+                if out is not None:
+                    out.write(encode(row) + "\n")
+
+        map_removed = 0
+        if args.map.exists():
+            raw_map = json.loads(args.map.read_text(encoding="utf-8"))
+            if isinstance(raw_map, dict) and removed_files:
+                for fname in list(raw_map.keys()):
+                    if fname in removed_files:
+                        raw_map.pop(fname, None)
+                        map_removed += 1
+            else:
+                raw_map = raw_map if isinstance(raw_map, dict) else {}
         else:
-            raw_map = raw_map if isinstance(raw_map, dict) else {}
-    else:
-        raw_map = {}
-
-    assets_deleted = 0
-    assets_missing = 0
-    for fname in sorted(removed_files):
-        target = args.assets_dir / fname
-        if target.exists():
-            if args.apply:
-                target.unlink()
-            assets_deleted += 1
-        else:
-            assets_missing += 1
-
-    print(
-        "Готово:" if args.apply else "Dry-run:",
-        f"номера={sorted(task_numbers)}",
-        f"internal_id={len(internal_ids)}",
-        f"расширения={sorted(drop_exts)}",
-        f"строк={tasks_seen}",
-        f"совпало={tasks_matched}",
-        f"images_удалено={images_removed}",
-        f"файлов_в_assets={assets_deleted}",
-        f"файлов_не_найдено={assets_missing}",
-        f"удалено_из_map={map_removed}",
-    )
+            raw_map = {}
+
+        assets_deleted = 0
+        assets_missing = 0
+        for fname in sorted(removed_files):
+            target = args.assets_dir / fname
+            if target.exists():
+                if args.apply:
+                    target.unlink()
+                assets_deleted += 1
+            else:
+                assets_missing += 1
+
+        print(
+            "Готово:" if args.apply else "Dry-run:",
+            f"номера={sorted(task_numbers)}",
+            f"internal_id={len(internal_ids)}",
+            f"расширения={sorted(drop_exts)}",
+            f"строк={tasks_seen}",
+            f"совпало={tasks_matched}",
+            f"images_удалено={images_removed}",
+            f"файлов_в_assets={assets_deleted}",
+            f"файлов_не_найдено={assets_missing}",
+            f"удалено_из_map={map_removed}",
+        )
+
+        if args.apply:
+            os.replace(tmp_path, args.tasks)
+    except BaseException:
+        if args.apply:
+            tmp_path.unlink(missing_ok=True)
+        raise
 
     if args.apply:
-        args.tasks.write_text("\n".join(out_lines) + "\n", encoding="utf-8")
         if isinstance(raw_map, dict):
             args.map.write_text(json.dumps(raw_map, ensure_ascii=False, indent=2), encoding="utf-8")
 
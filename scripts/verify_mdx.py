@@ -1,9 +1,16 @@
 from __future__ import annotations
 
 import argparse
+import heapq
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+CHECK_WORKERS = 32
+# Столько байт хватает, чтобы увидеть первую строку `---`.
+HEAD_PROBE_BYTES = 256
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -19,16 +26,35 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def main() -> None:
-    args = parse_args()
+def has_frontmatter(path: str | Path) -> bool:
+    """Первая строка файла (после strip) — `---`; читаем только начало файла."""
+    with open(path, "rb") as f:
+        head = f.read(HEAD_PROBE_BYTES)
+        lines = head.decode("utf-8", errors="replace").splitlines(keepends=True)
+        if len(head) == HEAD_PROBE_BYTES and len(lines) == 1:
+            # Первая строка длиннее пробы — дочитываем файл целиком.
+            lines = (head + f.read()).decode("utf-8").splitlines(keepends=True)
+    return bool(lines) and lines[0].strip() == "---"
+
+
+def check_mdx_file(entry: os.DirEntry[str]) -> str | None:
+    """"empty" / "no_frontmatter" для проблемного файла, иначе None."""
+    if entry.stat().st_size == 0:
+        return "empty"
+    if not has_frontmatter(entry.path):
+        return "no_frontmatter"
+    return None
 
-    if not args.input.exists():
-        raise FileNotFoundError(f"Не найден входной файл: {args.input}")
-    if not args.mdx_dir.exists():
-        raise FileNotFoundError(f"Не найдена папка MDX: {args.mdx_dir}")
+
+def run(input_path: Path, mdx_dir: Path, allow_extra: bool = False) -> bool:
+    """Печатает отчёт о проверке; True, если ошибок нет."""
+    if not input_path.exists():
+        raise FileNotFoundError(f"Не найден входной файл: {input_path}")
+    if not mdx_dir.exists():
+        raise FileNotFoundError(f"Не найдена папка MDX: {mdx_dir}")
 
     task_ids: set[str] = set()
-    with args.input.open(encoding="utf-8") as f:
+    with input_path.open("rb") as f:
         for line in f:
             line = line.strip()
             if not line:
@@ -38,21 +64,24 @@ def main() -> None:
             if internal_id:
                 task_ids.add(internal_id)
 
-    mdx_files = sorted(args.mdx_dir.glob("*.mdx"))
-    mdx_ids = {p.stem.upper() for p in mdx_files}
+    # scandir отдаёт имя и тип из readdir — без Path и лишних stat на каждый файл.
+    with os.scandir(mdx_dir) as it:
+        mdx_files = [e for e in it if e.name.endswith(".mdx") and e.is_file()]
+    mdx_files.sort(key=lambda e: e.name)
+    mdx_ids = {e.name.removesuffix(".mdx").upper() for e in mdx_files}
 
-    missing = sorted(task_ids - mdx_ids)
-    extra = sorted(mdx_ids - task_ids)
+    missing = task_ids - mdx_ids
+    extra = mdx_ids - task_ids
 
     empty_files: list[str] = []
     no_frontmatter: list[str] = []
-    for path in mdx_files:
-        if path.stat().st_size == 0:
-            empty_files.append(path.name)
-            continue
-        first_line = path.read_text(encoding="utf-8").splitlines()[:1]
-        if not first_line or first_line[0].strip() != "---":
-            no_frontmatter.append(path.name)
+    # Тысячи мелких stat/read: в пуле потоков задержки I/O перекрываются.
+    with ThreadPoolExecutor(max_workers=CHECK_WORKERS) as pool:
+        for entry, problem in zip(mdx_files, pool.map(check_mdx_file, mdx_files), strict=True):
+            if problem == "empty":
+                empty_files.append(entry.name)
+            elif problem == "no_frontmatter":
+                no_frontmatter.append(entry.name)
 
     print("Проверка MDX:")
     print(f"  задач в базе: {len(task_ids)}")
@@ -63,19 +92,25 @@ def main() -> None:
     print(f"  без frontmatter: {len(no_frontmatter)}")
 
     if missing:
-        print("Примеры отсутствующих:", ", ".join(missing[:20]))
-    if extra and not args.allow_extra:
-        print("Примеры лишних:", ", ".join(extra[:20]))
+        # Печатаем только первые 20 по порядку — сортировать всё множество незачем.
+        print("Примеры отсутствующих:", ", ".join(heapq.nsmallest(20, missing)))
+    if extra and not allow_extra:
+        print("Примеры лишних:", ", ".join(heapq.nsmallest(20, extra)))
     if empty_files:
         print("Пустые:", ", ".join(empty_files[:20]))
     if no_frontmatter:
         print("Без frontmatter:", ", ".join(no_frontmatter[:20]))
 
     has_errors = bool(missing or empty_files or no_frontmatter)
-    if extra and not args.allow_extra:
+    if extra and not allow_extra:
         has_errors = True
 
-    if has_errors:
+    return not has_errors
+
+
+def main() -> None:
+    args = parse_args()
+    if not run(args.input, args.mdx_dir, args.allow_extra):
         raise SystemExit(1)
 
 
@@ -22,57 +22,72 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
 import re
 from collections import Counter
+from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from urllib.parse import urlsplit
 
 from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import PreformattedString
+
+LEAF_NAMES = frozenset(
+    {
+        "mo",
+        "mi",
+        "mn",
+        "mtext",
+        "msym",
+        "m:mo",
+        "m:mi",
+        "m:mn",
+        "m:mtext",
+        "m:msym",
+    }
+)
+
+DROP_ATTRS = frozenset(
+    {
+        "class",
+        "style",
+        "bgcolor",
+        "width",
+        "height",
+        "align",
+        "valign",
+        "lang",
+        "svwidth",
+        "border",
+        "cellpadding",
+        "cellspacing",
+        "nowrap",
+    }
+)
+
+EMPTY_REMOVABLE_TAGS = frozenset(
+    {
+        "p",
+        "div",
+        "span",
+        "font",
+        "b",
+        "i",
+        "strong",
+        "em",
+        "u",
+        "sup",
+        "sub",
+    }
+)
 
-LEAF_NAMES = {
-    "mo",
-    "mi",
-    "mn",
-    "mtext",
-    "msym",
-    "m:mo",
-    "m:mi",
-    "m:mn",
-    "m:mtext",
-    "m:msym",
-}
-
-DROP_ATTRS = {
-    "class",
-    "style",
-    "bgcolor",
-    "width",
-    "height",
-    "align",
-    "valign",
-    "lang",
-    "svwidth",
-    "border",
-    "cellpadding",
-    "cellspacing",
-    "nowrap",
-}
-
-EMPTY_REMOVABLE_TAGS = {
-    "p",
-    "div",
-    "span",
-    "font",
-    "b",
-    "i",
-    "strong",
-    "em",
-    "u",
-    "sup",
-    "sub",
-}
-
-UNWRAP_TAGS = {"span", "font", "o:p"}
+UNWRAP_TAGS = frozenset({"span", "font", "o:p"})
+
+# Как у html.parser в bs4: в этих тегах пробельные строки не сворачиваются.
+PRESERVE_WHITESPACE_TAGS = frozenset({"pre", "textarea"})
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
 
 ATTACHMENTS_NOTICE_RE = re.compile(
     r"Задание\s+выполняется\s+с\s+использованием\s+прилагаемых(?:\s+к\s+заданию)?\s+файлов\s*\.",
@@ -81,10 +96,18 @@ ATTACHMENTS_NOTICE_RE = re.compile(
 
 KES_CODE_RE = re.compile(r"^\s*(?P<code>\d+(?:\.\d+)*)\b")
 
+IMPORT_PI_RE = re.compile(r"<\?import[^>]*?>", re.IGNORECASE)
+# ShowPictureQ2WH('zip','img',...) -> группы 1 и 2; ShowPictureQ('file') -> группа 3
+SHOW_PICTURE_RE = re.compile(r"ShowPictureQ2WH\('([^']*)','([^']*)'|ShowPictureQ\('([^']+)'")
+WHITESPACE_RE = re.compile(r"\s+")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+
 ATTACHMENT_LINK_EXTENSIONS = (".zip", ".rar", ".7z")
 
+JSONL_ENCODER = json.JSONEncoder(ensure_ascii=False)
 
-def parse_args() -> argparse.Namespace:
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", type=Path, default=Path("tasks.jsonl"))
     parser.add_argument("--output", type=Path, default=Path("tasks_clean.jsonl"))
@@ -116,12 +139,20 @@ def parse_args() -> argparse.Namespace:
         default=[".png", ".gif"],
         help="Расширения картинок для удаления (можно повторять), по умолчанию: .png и .gif",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Число процессов для очистки HTML (1 — без пула)",
+    )
+    return parser.parse_args(argv)
 
 
 def strip_import_pis(html: str) -> str:
     """Убираем `<?import namespace = m ...>` (Word/MathPlayer артефакт)."""
-    return re.sub(r"<\?import[^>]*?>", "", html, flags=re.IGNORECASE)
+    if "<?" not in html:
+        return html
+    return IMPORT_PI_RE.sub("", html)
 
 
 def strip_prefixes(tag: Tag, prefix: str = "m:") -> None:
@@ -135,20 +166,21 @@ def strip_prefixes(tag: Tag, prefix: str = "m:") -> None:
 
 def single_leaf_text(math_tag: Tag) -> str | None:
     """Если в math ровно один листовой узел из LEAF_NAMES — вернуть его текст."""
-    leaves: list[str] = []
-    for node in math_tag.find_all(True):
-        if node.find(True):
+    leaf: str | None = None
+    for node in math_tag.descendants:
+        if not isinstance(node, Tag) or node.name not in LEAF_NAMES:
+            continue
+        if any(isinstance(child, Tag) for child in node.children):
             continue
-        if node.name in LEAF_NAMES:
-            text = node.get_text(strip=True)
-            if text:
-                leaves.append(text)
-    if len(leaves) == 1:
-        return leaves[0]
-    return None
+        text = node.get_text(strip=True)
+        if text:
+            if leaf is not None:
+                return None
+            leaf = text
+    return leaf
 
 
-def _strip_attachments_notice(root: Tag, stats: Counter[str]) -> bool:
+def _strip_attachments_notice(rows: list[Tag], stats: Counter[str]) -> bool:
     """Удаляет строку-баннер про прилагаемые файлы (вместе с её табличной обвязкой).
 
     На FIPI это всегда отдельный `<tr>` с текстом-баннером и без другого содержимого.
@@ -156,12 +188,12 @@ def _strip_attachments_notice(root: Tag, stats: Counter[str]) -> bool:
     """
 
     removed = 0
-    for tr in list(root.find_all("tr")):
+    for tr in rows:
         text = tr.get_text(" ", strip=True)
         if not ATTACHMENTS_NOTICE_RE.search(text):
             continue
         rest = ATTACHMENTS_NOTICE_RE.sub("", text)
-        rest = re.sub(r"\s+", " ", rest).strip()
+        rest = WHITESPACE_RE.sub(" ", rest).strip()
         if rest:
             continue
         tr.decompose()
@@ -173,26 +205,37 @@ def _strip_attachments_notice(root: Tag, stats: Counter[str]) -> bool:
     return False
 
 
-def _strip_attachment_link_rows(root: Tag, stats: Counter[str]) -> int:
+def is_attachment_link(a_tag: Tag) -> bool:
+    href_lower = str(a_tag.get("href", "")).strip().lower()
+    return href_lower.startswith("assets/") and href_lower.endswith(ATTACHMENT_LINK_EXTENSIONS)
+
+
+def _strip_attachment_link_rows(rows: list[Tag], anchors: list[Tag], stats: Counter[str]) -> int:
     """Удаляет строки таблиц, которые содержат только ссылки на файлы (zip/rar) и иконки.
 
     Обычно это нижний `<tr>` вида:
       `<tr><td><a href="assets/X.zip">X.zip</a><img ...></td></tr>`
     Сами файлы остаются в поле `attachments`, UI/потребитель должен показывать их отдельно.
+    Разбираем только строки-предки ссылок на архивы из `anchors`.
     """
 
+    candidates: set[int] = set()
+    for a_tag in anchors:
+        # у ссылок, удалённых вместе с баннером, после decompose пустое имя
+        if a_tag.name == "a" and is_attachment_link(a_tag):
+            for parent in a_tag.parents:
+                if parent.name == "tr":
+                    candidates.add(id(parent))
+
     removed = 0
-    for tr in list(root.find_all("tr")):
+    for tr in rows:
+        if id(tr) not in candidates:
+            continue
         a_tags = tr.find_all("a", href=True)
         if not a_tags:
             continue
 
-        attachment_links: list[Tag] = []
-        for a_tag in a_tags:
-            href = str(a_tag.get("href", "")).strip()
-            href_lower = href.lower()
-            if href_lower.startswith("assets/") and href_lower.endswith(ATTACHMENT_LINK_EXTENSIONS):
-                attachment_links.append(a_tag)
+        attachment_links = [a_tag for a_tag in a_tags if is_attachment_link(a_tag)]
 
         if not attachment_links:
             continue
@@ -204,7 +247,7 @@ def _strip_attachment_link_rows(root: Tag, stats: Counter[str]) -> int:
             link_text = a_tag.get_text(" ", strip=True)
             if link_text:
                 text = text.replace(link_text, "")
-        text = re.sub(r"\s+", " ", text).strip()
+        text = WHITESPACE_RE.sub(" ", text).strip()
         if text:
             continue
 
@@ -216,9 +259,9 @@ def _strip_attachment_link_rows(root: Tag, stats: Counter[str]) -> int:
     return removed
 
 
-def _remove_empty_tables(root: Tag, stats: Counter[str]) -> None:
+def _remove_empty_tables(tables: list[Tag], stats: Counter[str]) -> None:
     removed = 0
-    for table in list(root.find_all("table")):
+    for table in tables:
         if table.get_text(" ", strip=True):
             continue
         if table.find("img") or table.find("a", href=True) or table.find("math"):
@@ -252,7 +295,7 @@ def url_extension(url: str) -> str:
     return Path(parsed.path).suffix.lower()
 
 
-def drop_images_field(row: dict, drop_exts: set[str], stats: Counter[str]) -> None:
+def drop_images_field(row: dict, drop_exts: Collection[str], stats: Counter[str]) -> None:
     images = row.get("images")
     if not isinstance(images, list):
         return
@@ -272,58 +315,101 @@ def drop_images_field(row: dict, drop_exts: set[str], stats: Counter[str]) -> No
         stats["images_field_dropped"] += removed
 
 
-def clean_html(
+def has_child_tag(tag: Tag) -> bool:
+    """То же, что `tag.find(True) is not None`, но без обхода через SoupStrainer."""
+    return any(isinstance(child, Tag) for child in tag.contents)
+
+
+def live_tags(tags: list[Tag], root: Tag, names: Collection[str]) -> list[Tag]:
+    """Теги из `tags` с именем из `names`, которые ещё лежат в `root`.
+
+    Заменяет `list(root.find_all(names))`: порядок документа тот же, а удалённые
+    (decompose или вынутые вместе с заменённым MathML) пропускаются. После decompose у
+    тега пустое имя; `tag.decomposed` не годится — на живом теге bs4 превращает чтение
+    `_decomposed` в `find("_decomposed")` по всему поддереву.
+    """
+    live: list[Tag] = []
+    for tag in tags:
+        if tag.name not in names:
+            continue
+        parent = tag.parent
+        while parent is not None and parent is not root:
+            parent = parent.parent
+        if parent is root:
+            live.append(tag)
+    return live
+
+
+def clean_tree(
     raw_html: str,
     stats: Counter[str],
     *,
-    drop_img_exts: set[str] | None = None,
-) -> tuple[str, bool]:
+    drop_img_exts: Collection[str] | None = None,
+) -> tuple[Tag, bool]:
+    """Разбирает и чистит HTML задачи; возвращает корневой `<root>` и флаг баннера."""
     html = strip_import_pis(raw_html)
     soup = BeautifulSoup(f"<root>{html}</root>", "html.parser")
     root = soup.find("root") or soup
 
-    if drop_img_exts:
-        removed = 0
-        for img in list(root.find_all("img")):
-            src = str(img.get("src", "")).strip()
-            if not src:
+    # Один проход по дереву: убираем картинки с запрещёнными расширениями, чистим теги
+    # и атрибуты, нормализуем неразрывные пробелы и заодно собираем <script> и MathML для
+    # специфичных замен ниже. Оставшиеся теги (в порядке документа) попадают в kept_tags:
+    # проходы ниже берут из него кандидатов через live_tags вместо find_all.
+    scripts: list[Tag] = []
+    math_tags: list[Tag] = []
+    kept_tags: list[Tag] = []
+    script_links: list[Tag] = []
+    for node in list(root.descendants):
+        if isinstance(node, NavigableString):
+            if "\xa0" in node:
+                node.replace_with(node.replace("\xa0", " "))
+            continue
+        if not isinstance(node, Tag):
+            continue
+        name = node.name
+        if name == "img" and drop_img_exts:
+            src = str(node.get("src", "")).strip()
+            if src and url_extension(src) in drop_img_exts:
+                node.decompose()
+                stats["img_tag_removed_by_ext"] += 1
                 continue
-            if url_extension(src) in drop_img_exts:
-                img.decompose()
-                removed += 1
-        if removed:
-            stats["img_tag_removed_by_ext"] += removed
-
-    # Чистим теги и атрибуты до специфичных замен
-    for tag in list(root.find_all(True)):
         # unwrap декоративных контейнеров
-        if tag.name in UNWRAP_TAGS or (tag.name == "div" and not tag.find("table")):
-            tag.unwrap()
+        if name in UNWRAP_TAGS or (name == "div" and not node.find("table")):
+            node.unwrap()
             continue
         # <br> -> перевод строки
-        if tag.name == "br":
-            tag.replace_with("\n")
+        if name == "br":
+            node.replace_with("\n")
             continue
         # удаляем ненужные атрибуты
-        for attr in list(tag.attrs):
-            if attr in DROP_ATTRS:
-                del tag.attrs[attr]
-
-    # нормализуем неразрывные пробелы
-    for text_node in root.find_all(string=True):
-        if "\xa0" in text_node:
-            text_node.replace_with(text_node.replace("\xa0", " "))
+        if node.attrs:
+            for attr in node.attrs.keys() & DROP_ATTRS:
+                del node.attrs[attr]
+        kept_tags.append(node)
+        if name == "script":
+            scripts.append(node)
+        elif name in {"math", "m:math"}:
+            math_tags.append(node)
 
     # Скрипты ShowPictureQ / ShowPictureQ2WH -> img (+ссылка на архив)
-    for script in list(root.find_all("script")):
+    for script in scripts:
         content = script.string or "".join(script.strings)
         if content:
-            # ShowPictureQ2WH('zip','gif',...)
-            for zip_name, img_name in re.findall(r"ShowPictureQ2WH\('([^']*)','([^']*)'", content):
+            # Один проход по тексту скрипта; картинки ShowPictureQ('file') вставляем
+            # после всех ShowPictureQ2WH, как и раньше.
+            single_names: list[str] = []
+            for match in SHOW_PICTURE_RE.finditer(content):
+                fname = match.group(3)
+                if fname is not None:
+                    single_names.append(fname)
+                    continue
+                # ShowPictureQ2WH('zip','gif',...)
+                zip_name, img_name = match.group(1, 2)
                 if zip_name:
                     link = soup.new_tag("a", href=f"assets/{zip_name}")
                     link.string = zip_name
                     script.insert_before(link)
+                    script_links.append(link)
                     stats["showpictureq2_link"] += 1
                 if img_name:
                     if drop_img_exts and url_extension(img_name) in drop_img_exts:
@@ -333,17 +419,17 @@ def clean_html(
                     script.insert_before(img)
                     stats["showpictureq2_img"] += 1
             # ShowPictureQ('file')
-        for fname in re.findall(r"ShowPictureQ\('([^']+)'", content):
-            if drop_img_exts and url_extension(fname) in drop_img_exts:
-                stats["showpictureq_img_dropped"] += 1
-                continue
-            img = soup.new_tag("img", src=f"assets/{fname}", alt="")
-            script.insert_before(img)
-            stats["showpictureq_replaced"] += 1
+            for fname in single_names:
+                if drop_img_exts and url_extension(fname) in drop_img_exts:
+                    stats["showpictureq_img_dropped"] += 1
+                    continue
+                img = soup.new_tag("img", src=f"assets/{fname}", alt="")
+                script.insert_before(img)
+                stats["showpictureq_replaced"] += 1
         script.decompose()
 
     # MathML обработка
-    for math_tag in list(root.find_all(lambda t: t.name in {"math", "m:math"})):
+    for math_tag in math_tags:
         text = single_leaf_text(math_tag)
         if text == "–":
             math_tag.replace_with(text)
@@ -352,51 +438,127 @@ def clean_html(
         strip_prefixes(math_tag)
         stats["math_kept"] += 1
 
-    # Убираем служебные якоря без href
-    for a_tag in list(root.find_all("a")):
+    # Убираем служебные якоря без href (ссылки из ShowPictureQ2WH всегда с href)
+    for a_tag in live_tags(kept_tags, root, {"a"}):
         if a_tag.get("href"):
             continue
-        if not a_tag.get_text(strip=True) and not a_tag.find(True):
+        if not a_tag.get_text(strip=True) and not has_child_tag(a_tag):
             a_tag.decompose()
             stats["empty_anchor_removed"] += 1
             continue
         a_tag.unwrap()
         stats["anchor_unwrapped"] += 1
 
-    attachments_notice_removed = _strip_attachments_notice(root, stats)
-    _strip_attachment_link_rows(root, stats)
+    rows = live_tags(kept_tags, root, {"tr"})
+    attachments_notice_removed = False
+    # Баннер ищется в тексте отдельных <tr>; если его нет во всём тексте, строки не смотрим.
+    if rows and ATTACHMENTS_NOTICE_RE.search(root.get_text(" ")):
+        attachments_notice_removed = _strip_attachments_notice(rows, stats)
+        rows = live_tags(kept_tags, root, {"tr"})
+    if rows:
+        anchors = live_tags(kept_tags, root, {"a"}) + script_links
+        _strip_attachment_link_rows(rows, anchors, stats)
 
     # Удаляем пустые параграфы/обёртки, которые остаются после чистки
-    for tag in list(root.find_all(EMPTY_REMOVABLE_TAGS)):
-        if tag.find(True):
+    for tag in live_tags(kept_tags, root, EMPTY_REMOVABLE_TAGS):
+        if has_child_tag(tag):
             continue
         if tag.get_text(strip=True):
             continue
         tag.decompose()
         stats["empty_tag_removed"] += 1
 
-    _remove_empty_tables(root, stats)
+    _remove_empty_tables(live_tags(kept_tags, root, {"table"}), stats)
 
     # Если верхний уровень — единственный служебный контейнер td/tr/tbody, разворачиваем его
-    def unwrap_single_wrapper(node: Tag) -> bool:
+    # (и так далее вглубь: сначала находим всю цепочку, потом разворачиваем сверху вниз)
+    wrappers: list[Tag] = []
+    node = root
+    while True:
         children = [c for c in node.contents if not (isinstance(c, str) and c.strip() == "")]
         if len(children) != 1:
-            return False
+            break
         child = children[0]
-        if not isinstance(child, Tag):
-            return False
-        if child.name not in {"td", "tr", "tbody"}:
-            return False
-        child.unwrap()
-        return True
+        if not isinstance(child, Tag) or child.name not in {"td", "tr", "tbody"}:
+            break
+        wrappers.append(child)
+        node = child
+    for wrapper in wrappers:
+        wrapper.unwrap()
+    if wrappers:
+        stats["wrapper_unwrapped"] += len(wrappers)
+
+    return root, attachments_notice_removed
 
-    while unwrap_single_wrapper(root):
-        stats["wrapper_unwrapped"] += 1
 
+def clean_html(
+    raw_html: str,
+    stats: Counter[str],
+    *,
+    drop_img_exts: Collection[str] | None = None,
+) -> tuple[str, bool]:
+    root, attachments_notice_removed = clean_tree(raw_html, stats, drop_img_exts=drop_img_exts)
     cleaned = "".join(str(child) for child in root.contents)
     return cleaned, attachments_notice_removed
 
 
+def reparses_as_tree(root: Tag) -> bool:
+    """Даст ли разбор `clean_html(...)` то же дерево, что и `root` (с точностью до строк).
+
+    Верхний уровень сериализуется через `str(child)`: строки идут без экранирования, а
+    комментарии/CDATA/PI — одним содержимым. Такой текст при разборе меняет структуру.
+    """
+    for child in root.contents:
+        if isinstance(child, NavigableString) and (
+            isinstance(child, PreformattedString) or "<" in child or "&" in child
+        ):
+            return False
+    return True
+
+
+def normalize_strings(tag: Tag, preserve_whitespace: bool = False) -> None:
+    """Приводит текстовые узлы к виду, который дал бы повторный разбор `str(tag)`.
+
+    После чистки в дереве остаются соседние строки (от unwrap и `<br>` -> "\\n") и
+    строки из одних пробелов (бывший `&nbsp;`). html.parser склеивает соседний текст, а
+    строку только из ASCII-пробелов сворачивает в "\\n" или " " (кроме `<pre>`/`<textarea>`).
+    """
+    preserve_whitespace = preserve_whitespace or tag.name in PRESERVE_WHITESPACE_TAGS
+    run: list[NavigableString] = []
+    for child in list(tag.contents):
+        if isinstance(child, NavigableString) and not isinstance(child, PreformattedString):
+            run.append(child)
+            continue
+        if run:
+            _merge_string_run(run, preserve_whitespace)
+            run = []
+        if isinstance(child, Tag):
+            normalize_strings(child, preserve_whitespace)
+    if run:
+        _merge_string_run(run, preserve_whitespace)
+
+
+def collapse_blank_string(text: str) -> str:
+    """Как html.parser в bs4: строка из одних ASCII-пробелов становится "\\n" или " "."""
+    if text and not text.strip(ASCII_SPACES):
+        return "\n" if "\n" in text else " "
+    return text
+
+
+def _merge_string_run(run: list[NavigableString], preserve_whitespace: bool) -> None:
+    text = "".join(run)
+    if not preserve_whitespace:
+        text = collapse_blank_string(text)
+    if len(run) == 1 and text == run[0]:
+        return
+    for extra in run[1:]:
+        extra.extract()
+    if text:
+        run[0].replace_with(type(run[0])(text))
+    else:
+        run[0].extract()
+
+
 def render_children(tag: Tag, indent: str = "") -> str:
     return "".join(render_node(child, indent) for child in tag.children)
 
@@ -472,23 +634,94 @@ def render_node(node: Tag | NavigableString, indent: str = "") -> str:
     return render_children(node, indent)
 
 
+@lru_cache(maxsize=4096)
 def html_to_markdown(cleaned_html: str) -> str:
     """Грубая конверсия в GFM с сохранением таблиц/MathML как встроенного HTML."""
 
+    if "<" not in cleaned_html and "&" not in cleaned_html:
+        # Чистый текст: разбор дал бы одну строку, BeautifulSoup не нужен.
+        md = BLANK_LINES_RE.sub("\n\n", collapse_blank_string(cleaned_html))
+        return md.strip() + "\n"
     soup = BeautifulSoup(f"<root>{cleaned_html}</root>", "html.parser")
     root = soup.find("root") or soup
+    return tree_to_markdown(root)
+
+
+def tree_to_markdown(root: Tag) -> str:
+    """`html_to_markdown` для уже разобранного дерева (строки — см. `normalize_strings`)."""
     md = render_children(root)
-    md = re.sub(r"\n{3,}", "\n\n", md)
+    md = BLANK_LINES_RE.sub("\n\n", md)
     return md.strip() + "\n"
 
 
-def main() -> None:
-    args = parse_args()
+@lru_cache(maxsize=4096)
+def clean_html_cached(
+    raw_html: str, drop_img_exts: frozenset[str] | None
+) -> tuple[str, str, bool, tuple[tuple[str, int], ...]]:
+    """Очищенный HTML и Markdown задачи с памятью: одинаковый question_html встречается не раз.
+
+    Markdown строится по тому же дереву, без повторного разбора очищенного HTML.
+    Статистика возвращается приращениями, чтобы попадание в кэш учитывалось так же.
+    """
+    if "<" not in raw_html and "&" not in raw_html:
+        # Ни тегов, ни сущностей: html.parser дал бы одну текстовую строку и чистить нечего.
+        cleaned_html = collapse_blank_string(raw_html).replace("\xa0", " ")
+        return cleaned_html, html_to_markdown(cleaned_html), False, ()
+
+    stats: Counter[str] = Counter()
+    root, banner_removed = clean_tree(raw_html, stats, drop_img_exts=drop_img_exts)
+    cleaned_html = "".join(str(child) for child in root.contents)
+    if reparses_as_tree(root):
+        normalize_strings(root)
+        question_md = tree_to_markdown(root)
+    else:
+        question_md = html_to_markdown(cleaned_html)
+    return cleaned_html, question_md, banner_removed, tuple(stats.items())
+
+
+def clean_row(
+    row: dict, stats: Counter[str], *, drop_img_exts: frozenset[str] | None
+) -> None:
+    """Заменяет `question_html` задачи очищенным HTML и Markdown (на месте)."""
+    raw_html = row.get("question_html", "")
+    cleaned_html, question_md, banner_removed, stats_delta = clean_html_cached(
+        raw_html, drop_img_exts
+    )
+    for key, count in stats_delta:
+        stats[key] += count
+    row["question_html_clean"] = cleaned_html
+    row["question_md"] = question_md
+    has_attachments = bool(row.get("attachments"))
+    notice_in_text = bool(ATTACHMENTS_NOTICE_RE.search(str(row.get("question_text", ""))))
+    row["requires_attachments"] = has_attachments or banner_removed or notice_in_text
+    if banner_removed or notice_in_text:
+        question_text = str(row.get("question_text", ""))
+        question_text = ATTACHMENTS_NOTICE_RE.sub("", question_text)
+        question_text = WHITESPACE_RE.sub(" ", question_text).strip()
+        row["question_text"] = question_text
+    # В clean-версии не храним сырое question_html
+    row.pop("question_html", None)
+
+
+def clean_row_line(
+    row: dict, drop_img_exts: frozenset[str] | None
+) -> tuple[str, Counter[str]]:
+    """Воркер пула: очищает задачу и возвращает строку JSONL и свою статистику."""
+    stats: Counter[str] = Counter()
+    clean_row(row, stats, drop_img_exts=drop_img_exts)
+    return JSONL_ENCODER.encode(row) + "\n", stats
+
+
+def transform_rows(rows: Iterable[dict], args: argparse.Namespace) -> None:
+    """Очищает задачи из `rows` и пишет `args.output` и справочник КЭС.
+
+    `args.input` не читается: строки передаёт вызывающий (файл или задачи в памяти).
+    """
     stats: Counter[str] = Counter()
     kes_text_by_code: dict[str, str] = {}
 
     drop_internal_ids: set[str] = set()
-    drop_exts: set[str] = set()
+    drop_exts: frozenset[str] = frozenset()
     if args.drop_images_for_task_number:
         raw = json.loads(args.internal_id_to_task_number.read_text(encoding="utf-8"))
         if isinstance(raw, dict):
@@ -498,9 +731,9 @@ def main() -> None:
                 for iid, num in raw.items()
                 if isinstance(iid, str) and num in wanted
             }
-            drop_exts = {
+            drop_exts = frozenset(
                 str(ext).lower() for ext in args.drop_image_ext if str(ext).startswith(".")
-            }
+            )
             print(
                 "Фильтрация картинок включена:",
                 f"номера={sorted(wanted)}",
@@ -508,10 +741,9 @@ def main() -> None:
                 f"расширения={sorted(drop_exts)}",
             )
 
-    with args.input.open() as fin, args.output.open("w") as fout:
-        for line in fin:
-            row = json.loads(line)
-
+    def prepared_rows() -> Iterator[tuple[dict, frozenset[str] | None]]:
+        """Фильтрация поля images и сбор КЭС — в порядке строк, в этом процессе."""
+        for row in rows:
             internal_id = str(row.get("internal_id", "")).strip().lower()
             apply_drop = bool(drop_internal_ids) and internal_id in drop_internal_ids
             if apply_drop and drop_exts:
@@ -534,10 +766,8 @@ def main() -> None:
                             stats["kes_invalid_items"] += 1
                             continue
 
-                        existing = kes_text_by_code.get(code)
-                        if existing is None:
-                            kes_text_by_code[code] = item
-                        elif existing != item:
+                        existing = kes_text_by_code.setdefault(code, item)
+                        if existing != item:
                             # На практике тексты должны совпадать.
                             # Если нет — выбираем более информативный.
                             if len(item) > len(existing):
@@ -549,44 +779,42 @@ def main() -> None:
                             codes.append(code)
                     meta["КЭС"] = codes
 
-            raw_html = row.get("question_html", "")
-            cleaned_html, banner_removed = clean_html(
-                raw_html, stats, drop_img_exts=drop_exts if apply_drop else None
-            )
-            row["question_html_clean"] = cleaned_html
-            row["question_md"] = html_to_markdown(cleaned_html)
-            has_attachments = bool(row.get("attachments"))
-            notice_in_text = bool(
-                ATTACHMENTS_NOTICE_RE.search(str(row.get("question_text", "")))
-            )
-            row["requires_attachments"] = has_attachments or banner_removed or notice_in_text
-            if banner_removed or notice_in_text:
-                question_text = str(row.get("question_text", ""))
-                question_text = ATTACHMENTS_NOTICE_RE.sub("", question_text)
-                question_text = re.sub(r"\s+", " ", question_text).strip()
-                row["question_text"] = question_text
-            # В clean-версии не храним сырое question_html
-            row.pop("question_html", None)
-            fout.write(json.dumps(row, ensure_ascii=False) + "\n")
-            stats["rows"] += 1
+            yield row, drop_exts if apply_drop else None
+
+    encode = JSONL_ENCODER.encode
+    with args.output.open("w", encoding="utf-8") as fout:
+        if args.workers <= 1:
+            for row, drop_img_exts in prepared_rows():
+                clean_row(row, stats, drop_img_exts=drop_img_exts)
+                fout.write(encode(row) + "\n")
+                stats["rows"] += 1
+        else:
+            jobs = list(prepared_rows())
+            chunksize = max(1, len(jobs) // (args.workers * 4))
+            with ProcessPoolExecutor(max_workers=args.workers) as pool:
+                results = pool.map(
+                    clean_row_line,
+                    [row for row, _ in jobs],
+                    [drop_img_exts for _, drop_img_exts in jobs],
+                    chunksize=chunksize,
+                )
+                for line, row_stats in results:
+                    fout.write(line)
+                    stats.update(row_stats)
+                    stats["rows"] += 1
 
     kes_items = [
         {"id": code, "text": text, "section": int(code.split(".")[0])}
         for code, text in kes_text_by_code.items()
     ]
     kes_items.sort(key=lambda item: code_sort_key(item["id"]))
+    kes_payload = (json.dumps(kes_items, ensure_ascii=False, indent=2) + "\n").encode("utf-8")
     args.kes_output.parent.mkdir(parents=True, exist_ok=True)
-    args.kes_output.write_text(
-        json.dumps(kes_items, ensure_ascii=False, indent=2) + "\n",
-        encoding="utf-8",
-    )
+    args.kes_output.write_bytes(kes_payload)
     frontend_kes_path = Path("frontend/src/reference/kes.json")
     if frontend_kes_path.resolve() != args.kes_output.resolve():
         frontend_kes_path.parent.mkdir(parents=True, exist_ok=True)
-        frontend_kes_path.write_text(
-            json.dumps(kes_items, ensure_ascii=False, indent=2) + "\n",
-            encoding="utf-8",
-        )
+        frontend_kes_path.write_bytes(kes_payload)
     stats["kes_items_written"] = len(kes_items)
 
     print(
@@ -614,5 +842,11 @@ def main() -> None:
     )
 
 
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    with args.input.open("rb") as fin:
+        transform_rows((json.loads(line) for line in fin), args)
+
+
 if __name__ == "__main__":
     main()